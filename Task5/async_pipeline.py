@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Асинхронный RAG пайплайн для параллельной обработки запросов
+"""
+
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+from config import config
+from llm_client import AsyncLLMClient, DeadlineExceeded, LLMError
+from metrics import metrics
+from router import is_unknown, large_route
+from rag_pipeline import RAGPipeline
+
+class AsyncRAGPipeline:
+    """
+    Эмбеддинги и векторный поиск выполняются в пуле потоков, LLM вызывается
+    через асинхронный HTTP-клиент. Семафор ограничивает число одновременных
+    запросов к Ollama, поэтому в одном процессе может ждать ответа много запросов.
+    """
+
+    def __init__(self, pipeline: Optional[RAGPipeline] = None, max_llm_concurrency: int = None):
+        self.pipeline = pipeline or RAGPipeline()
+        self.executor = ThreadPoolExecutor(
+            max_workers=config.ASYNC_RETRIEVAL_WORKERS,
+            thread_name_prefix="rag-retrieval"
+        )
+        self.llm_clients = {
+            "large": AsyncLLMClient(model=config.LLM_MODEL),
+            "small": AsyncLLMClient(model=config.LLM_SMALL_MODEL)
+        }
+        self.llm_semaphore = asyncio.Semaphore(max_llm_concurrency or config.ASYNC_MAX_LLM_CONCURRENCY)
+
+    async def process_query(self, query: str, deadline: float = None) -> str:
+        budget = deadline if deadline is not None else config.QUERY_DEADLINE_S
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        context_chunks, early_response = await loop.run_in_executor(
+            self.executor, self.pipeline.prepare_context, query
+        )
+        if early_response is not None:
+            return early_response
+
+        # Справки при первом обращении читаются с диска и сверяются с документами - не в цикле событий
+        direct = await loop.run_in_executor(self.executor, self.pipeline.direct_answer, query, context_chunks)
+        if direct is not None:
+            return direct
+
+        try:
+            if not budget:
+                return await self.generate_routed(query, context_chunks)
+            remaining = max(budget - (loop.time() - started), 0)
+            generation = self.generate_routed(query, context_chunks, time.monotonic() + remaining)
+            return await asyncio.wait_for(generation, timeout=remaining)
+        except (asyncio.TimeoutError, DeadlineExceeded):
+            return self.degraded_response(query, context_chunks, "deadline")
+        except LLMError:
+            return self.degraded_response(query, context_chunks, "error")
+
+    def degraded_response(self, query: str, context_chunks: List[Dict], reason: str) -> str:
+        """Как RAGPipeline.guarded_stream без частичного ответа: причина в метриках и fallback_response"""
+        metrics.inc(f'query_degraded_total{{reason="{reason}_fallback"}}')
+        print(f"⏱️ Ответ LLM не получен ({reason}), возвращается извлеченный фрагмент контекста")
+        return self.pipeline.fallback_response(query, context_chunks)
+
+    async def generate_routed(self, query: str, context_chunks: List[Dict], deadline_at: float = None) -> str:
+        """Ответ модели по маршруту RAGPipeline.route, с эскалацией, если малая модель не знает ответа"""
+        loop = asyncio.get_running_loop()
+        # route() может проверить /api/tags блокирующим HTTP-запросом
+        route = await loop.run_in_executor(self.executor, self.pipeline.route, query, context_chunks)
+        answer = await self.generate(self.pipeline.prepare_prompt(query, context_chunks, route["use_cot"]),
+                                     route, deadline_at)
+        if route["tier"] == "small" and config.ROUTER_ESCALATE_ON_UNKNOWN and is_unknown(answer):
+            metrics.inc("router_escalations_total")
+            route = large_route("эскалация")
+            answer = await self.generate(self.pipeline.prepare_prompt(query, context_chunks, route["use_cot"]),
+                                         route, deadline_at)
+        return answer
+
+    async def generate(self, prompt: str, route: Dict = None, deadline_at: float = None) -> str:
+        route = route or large_route("по умолчанию")
+        async with self.llm_semaphore:
+            return await self.llm_clients[route["tier"]].generate(
+                prompt, system_prompt=self.pipeline.system_prompt(route["use_cot"]), deadline_at=deadline_at
+            )
+
+    async def process_queries(self, queries: List[str]) -> List[str]:
+        """Параллельная обработка списка запросов; ответы в порядке запросов"""
+        return await asyncio.gather(*(self.process_query(q) for q in queries))
+
+    async def aclose(self) -> None:
+        for llm_client in self.llm_clients.values():
+            await llm_client.aclose()
+        self.executor.shutdown(wait=False)
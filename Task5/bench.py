@@ -0,0 +1,325 @@
+#!/usr/bin/env python3
+"""
+Сравнительные замеры пайплайна на наборе вопросов (по умолчанию questions.txt)
+
+    python bench.py context   - токены промпта: чанки как есть против упакованного контекста
+    python bench.py prefix    - prefill в Ollama: промпт одной строкой против system-префикса
+    python bench.py topk      - адаптивный top-k против фиксированного k=SEARCH_RESULTS_COUNT
+    python bench.py rerank    - контекст после кросс-энкодера против всех найденных чанков
+    python bench.py cascade   - каскад малая/большая модель против большой модели с CoT на всех вопросах
+    python bench.py detector  - калибровка детектора prompt injection: ложные срабатывания на всей базе знаний
+"""
+
+import argparse
+import json
+import time
+
+import numpy as np
+
+from config import config
+from context_packer import count_tokens
+from injection_scanner import get_scanner
+from prompts import build_rag_prompt
+from router import is_unknown, large_route
+
+def load_questions(path: str):
+    with open(path, 'r', encoding='utf-8') as f:
+        return [line.strip() for line in f if line.strip()]
+
+def print_table(title: str, columns, rows, summary) -> None:
+    print("\n" + "=" * 80)
+    print(title)
+    print("=" * 80)
+    print(" | ".join(f"{c:>10}" for c in columns) + " | вопрос")
+    for row in rows:
+        print(" | ".join(f"{row[c]:>10}" for c in columns) + f" | {row['question'][:40]}")
+    print("-" * 80)
+    for name, value in summary.items():
+        print(f"   {name}: {value}")
+
+def save_report(path: str, report: dict) -> None:
+    if path:
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2, sort_keys=True)
+        print(f"\n💾 Отчет сохранен в: {path}")
+
+def bench_context(rag, questions):
+    """Токены промпта без упаковки контекста и с упаковкой"""
+    rows = []
+    for question, results in zip(questions, rag.retrieve_chunks_batch(questions)):
+        context_chunks, early_response = rag.prepare_context(question, results)
+        if early_response is not None:
+            continue
+
+        start_time = time.perf_counter()
+        packed_prompt = rag.system_prompt() + "\n\n" + rag.prepare_prompt(question, context_chunks)
+        pack_time = time.perf_counter() - start_time
+
+        verbatim_prompt = build_rag_prompt(
+            question=question,
+            context_chunks=[chunk["text"] for chunk in context_chunks],
+            use_cot=config.ENABLE_CHAIN_OF_THOUGHT,
+            protection_enabled=rag.protection_enabled
+        )
+        rows.append({
+            "question": question,
+            "verbatim": count_tokens(verbatim_prompt),
+            "packed": count_tokens(packed_prompt),
+            "pack_ms": round(pack_time * 1000, 2)
+        })
+
+    if not rows:
+        print("❌ Нет вопросов с найденным контекстом")
+        return {}
+
+    verbatim = sum(r["verbatim"] for r in rows) / len(rows)
+    packed = sum(r["packed"] for r in rows) / len(rows)
+    summary = {
+        "Средние токены промпта (как есть)": round(verbatim, 1),
+        "Средние токены промпта (упаковка)": round(packed, 1),
+        "Сокращение": f"{(1 - packed / verbatim) * 100:.1f}%"
+    }
+    print_table("📦 УПАКОВКА КОНТЕКСТА", ["verbatim", "packed", "pack_ms"], rows, summary)
+    return {"rows": rows, "summary": summary}
+
+def bench_prefix(rag, questions):
+    """
+    Токены и время prefill, которые Ollama реально вычислила (prompt_eval_*):
+    весь промпт одной строкой против стабильного system-префикса с keep_alive
+    """
+    contexts = []
+    for question, results in zip(questions, rag.retrieve_chunks_batch(questions)):
+        context_chunks, early_response = rag.prepare_context(question, results)
+        if early_response is None:
+            contexts.append((question, rag.prepare_prompt(question, context_chunks)))
+
+    if not contexts:
+        print("❌ Нет вопросов с найденным контекстом")
+        return {}
+
+    system_prompt = rag.system_prompt()
+    rag.llm_client.warmup(system_prompt)
+
+    rows = {question: {"question": question} for question, _ in contexts}
+    for layout in ("inline", "system"):
+        for question, prompt in contexts:
+            if layout == "inline":
+                _, stats = rag.llm_client.generate_with_stats(f"{system_prompt}\n\n{prompt}", num_predict=1)
+            else:
+                _, stats = rag.llm_client.generate_with_stats(prompt, system_prompt, num_predict=1)
+            rows[question][f"{layout}_tok"] = stats.get("prompt_eval_count", 0)
+            rows[question][f"{layout}_ms"] = round(stats.get("prompt_eval_seconds", 0) * 1000, 1)
+
+    rows = list(rows.values())
+    summary = {}
+    for column in ("inline_tok", "system_tok", "inline_ms", "system_ms"):
+        summary[f"Среднее {column}"] = round(sum(r[column] for r in rows) / len(rows), 1)
+    saved = summary["Среднее inline_ms"] - summary["Среднее system_ms"]
+    summary["Экономия prefill на запрос"] = f"{saved:.1f} мс"
+    print_table("⚡ PREFILL: ПРОМПТ ОДНОЙ СТРОКОЙ ПРОТИВ SYSTEM-ПРЕФИКСА",
+                ["inline_tok", "system_tok", "inline_ms", "system_ms"], rows, summary)
+    return {"rows": rows, "summary": summary}
+
+def bench_topk(rag, questions, generate: bool = True):
+    """Число чанков, токены промпта и время ответа: фиксированный k против адаптивного"""
+    config.ADAPTIVE_TOP_K_ENABLED = True
+    config.RERANK_ENABLED = False  # сравнивается только отбор по расстояниям
+    modes = {
+        "fixed": rag.retrieve_chunks_batch(questions, n_results=config.SEARCH_RESULTS_COUNT),
+        "adaptive": rag.retrieve_chunks_batch(questions)
+    }
+
+    rows = []
+    for i, question in enumerate(questions):
+        row = {"question": question}
+        for mode, batch_results in modes.items():
+            context_chunks, early_response = rag.prepare_context(question, batch_results[i])
+            if early_response is not None:
+                break
+            prompt = rag.prepare_prompt(question, context_chunks)
+            row[f"{mode}_k"] = len(context_chunks)
+            row[f"{mode}_tok"] = count_tokens(rag.system_prompt()) + count_tokens(prompt)
+
+            start_time = time.perf_counter()
+            if generate:
+                rag.generate_answer(question, context_chunks, rag.deadline_at())
+            row[f"{mode}_s"] = round(time.perf_counter() - start_time, 2)
+        else:
+            rows.append(row)
+
+    if not rows:
+        print("❌ Нет вопросов с найденным контекстом")
+        return {}
+
+    columns = ["fixed_k", "adaptive_k", "fixed_tok", "adaptive_tok", "fixed_s", "adaptive_s"]
+    summary = {f"Среднее {column}": round(sum(r[column] for r in rows) / len(rows), 2) for column in columns}
+    fixed_tok, adaptive_tok = summary["Среднее fixed_tok"], summary["Среднее adaptive_tok"]
+    summary["Сокращение токенов промпта"] = f"{(1 - adaptive_tok / fixed_tok) * 100:.1f}%"
+    print_table(f"🎯 АДАПТИВНЫЙ TOP-K ПРОТИВ k={config.SEARCH_RESULTS_COUNT}", columns, rows, summary)
+    return {"rows": rows, "summary": summary}
+
+def bench_rerank(rag, questions, generate: bool = True):
+    """Токены промпта и время ответа без переранжирования и с ним, время кросс-энкодера"""
+    if config.EMBEDDING_BACKEND == "fake":
+        print("⚠️ Переранжирование не замеряется при EMBEDDING_BACKEND=fake: кросс-энкодеру нужна модель с HF hub")
+        return {"rows": [], "summary": {}}
+    config.RERANK_ENABLED = False
+    rows = []
+    candidates = rag.retrieve_chunks_batch(questions, n_results=config.RERANK_CANDIDATES)
+    for question, results in zip(questions, candidates):
+        context_chunks, early_response = rag.prepare_context(question, results)
+        if early_response is not None:
+            continue
+
+        start_time = time.perf_counter()
+        reranked = rag.reranker.rerank(question, context_chunks)
+        rerank_time = time.perf_counter() - start_time
+
+        row = {"question": question, "k": len(context_chunks), "rerank_ms": round(rerank_time * 1000, 1)}
+        for mode, chunks in (("all", context_chunks), ("rerank", reranked)):
+            row[f"{mode}_tok"] = count_tokens(rag.system_prompt()) + count_tokens(rag.prepare_prompt(question, chunks))
+            start_time = time.perf_counter()
+            if generate:
+                rag.generate_answer(question, chunks, rag.deadline_at())
+            row[f"{mode}_s"] = round(time.perf_counter() - start_time, 2)
+        if generate:
+            row["rerank_s"] = round(row["rerank_s"] + rerank_time, 2)
+        rows.append(row)
+
+    if not rows:
+        print("❌ Нет вопросов с найденным контекстом")
+        return {}
+
+    columns = ["k", "rerank_ms", "all_tok", "rerank_tok", "all_s", "rerank_s"]
+    summary = {f"Среднее {column}": round(sum(r[column] for r in rows) / len(rows), 2) for column in columns}
+    all_tok, rerank_tok = summary["Среднее all_tok"], summary["Среднее rerank_tok"]
+    summary["Сокращение токенов промпта"] = f"{(1 - rerank_tok / all_tok) * 100:.1f}%"
+    print_table(f"🔀 ПЕРЕРАНЖИРОВАНИЕ: ВСЕ ЧАНКИ ПРОТИВ TOP-{config.RERANK_TOP_N}", columns, rows, summary)
+    return {"rows": rows, "summary": summary}
+
+def bench_cascade(rag, questions):
+    """Токены (prefill + генерация) и время ответа: каскад моделей против большой модели с CoT"""
+    def run(question, context_chunks, route):
+        llm_client = rag.small_llm_client if route["tier"] == "small" else rag.llm_client
+        start_time = time.perf_counter()
+        answer, stats = llm_client.generate_with_stats(
+            rag.prepare_prompt(question, context_chunks, route["use_cot"]),
+            rag.system_prompt(route["use_cot"])
+        )
+        tokens = stats.get("prompt_eval_count", 0) + stats.get("eval_count", 0)
+        return answer, tokens, time.perf_counter() - start_time
+
+    rows = []
+    for question, results in zip(questions, rag.retrieve_chunks_batch(questions)):
+        context_chunks, early_response = rag.prepare_context(question, results)
+        if early_response is not None:
+            continue
+
+        _, base_tok, base_s = run(question, context_chunks, large_route("без каскада"))
+
+        route = rag.route(question, context_chunks)
+        answer, cascade_tok, cascade_s = run(question, context_chunks, route)
+        tier = route["tier"]
+        if tier == "small" and config.ROUTER_ESCALATE_ON_UNKNOWN and is_unknown(answer):
+            _, extra_tok, extra_s = run(question, context_chunks, large_route("эскалация"))
+            cascade_tok, cascade_s, tier = cascade_tok + extra_tok, cascade_s + extra_s, "small→large"
+
+        rows.append({
+            "question": question,
+            "tier": tier,
+            "base_tok": base_tok,
+            "cascade_tok": cascade_tok,
+            "base_s": round(base_s, 2),
+            "cascade_s": round(cascade_s, 2)
+        })
+
+    if not rows:
+        print("❌ Нет вопросов с найденным контекстом")
+        return {}
+
+    columns = ["tier", "base_tok", "cascade_tok", "base_s", "cascade_s"]
+    summary = {f"Среднее {column}": round(sum(r[column] for r in rows) / len(rows), 2) for column in columns[1:]}
+    summary["Доля вопросов на малой модели"] = f"{sum(r['tier'] == 'small' for r in rows) / len(rows) * 100:.0f}%"
+    summary["Эскалаций"] = sum(r["tier"] == "small→large" for r in rows)
+    base_tok, cascade_tok = summary["Среднее base_tok"], summary["Среднее cascade_tok"]
+    base_s, cascade_s = summary["Среднее base_s"], summary["Среднее cascade_s"]
+    summary["Экономия токенов"] = f"{(1 - cascade_tok / base_tok) * 100:.1f}%" if base_tok else "н/д"
+    summary["Экономия времени"] = f"{(1 - cascade_s / base_s) * 100:.1f}%" if base_s else "н/д"
+    print_table(f"🪜 КАСКАД {config.LLM_SMALL_MODEL} / {config.LLM_MODEL} ПРОТИВ {config.LLM_MODEL} + CoT",
+                columns, rows, summary)
+    return {"rows": rows, "summary": summary}
+
+def bench_detector(rag, thresholds=(0.4, 0.5, 0.6, 0.7, 0.8), top: int = 15):
+    """
+    Близость каждого чанка коллекции к центроидам атак и число отброшенных чанков
+    при разных порогах. Атакой считается чанк с совпадением INJECTION_PATTERNS,
+    остальные срабатывания детектора - ложные (в базе знаний нет настоящих атак без шаблонов).
+    """
+    detector = rag.injection_detector
+    stored = rag.collection.get(include=["documents", "embeddings"])
+    if not stored["ids"]:
+        print("❌ Коллекция пуста")
+        return {}
+
+    similarity = detector.normalize(np.asarray(stored["embeddings"], dtype=np.float32)) @ detector.centroids.T
+    best, scores = similarity.argmax(axis=1), similarity.max(axis=1)
+    scanner = get_scanner()
+    attacks = np.array([scanner.is_flagged(text) for text in stored["documents"]])
+    clean_scores = scores[~attacks]
+
+    # Самые "подозрительные" чанки без шаблонов атак: кандидаты в ложные срабатывания
+    rows = []
+    for index in np.argsort(-np.where(attacks, -np.inf, scores))[:min(top, len(clean_scores))]:
+        rows.append({
+            "question": " ".join(stored["documents"][index].split()),
+            "category": detector.categories[best[index]],
+            "similarity": round(float(scores[index]), 3),
+            "flagged": "да" if scores[index] >= detector.threshold else "нет"
+        })
+
+    summary = {
+        "Чанков в коллекции": len(scores),
+        "Из них с шаблонами атак": int(attacks.sum()),
+        "Текущий порог": detector.threshold
+    }
+    for threshold in sorted(set(thresholds) | {detector.threshold}):
+        false_positives = int((clean_scores >= threshold).sum())
+        found = int((scores[attacks] >= threshold).sum())
+        summary[f"Порог {threshold}"] = (f"ложных срабатываний {false_positives} "
+                                         f"({false_positives / max(len(clean_scores), 1) * 100:.1f}%), "
+                                         f"атак найдено {found} из {int(attacks.sum())}")
+    if len(clean_scores):
+        summary["Минимальный порог без ложных срабатываний"] = round(float(clean_scores.max()) + 0.001, 3)
+    print_table("🛡️ КАЛИБРОВКА ДЕТЕКТОРА PROMPT INJECTION (чанки без шаблонов атак, по убыванию близости)",
+                ["category", "similarity", "flagged"], rows, summary)
+    return {"rows": rows, "summary": summary}
+
+def main():
+    parser = argparse.ArgumentParser(description="Замеры RAG пайплайна")
+    parser.add_argument("mode", choices=["context", "prefix", "topk", "rerank", "cascade", "detector"], help="Что сравнивать")
+    parser.add_argument("--questions", default="questions.txt", help="Файл с вопросами")
+    parser.add_argument("--output", help="JSON-файл для отчета")
+    parser.add_argument("--no-llm", action="store_true", help="topk/rerank: не вызывать LLM, сравнить только чанки и токены")
+    args = parser.parse_args()
+
+    from rag_pipeline import RAGPipeline
+    rag = RAGPipeline()
+    questions = load_questions(args.questions)
+
+    if args.mode == "context":
+        report = bench_context(rag, questions)
+    elif args.mode == "prefix":
+        report = bench_prefix(rag, questions)
+    elif args.mode == "topk":
+        report = bench_topk(rag, questions, generate=not args.no_llm)
+    elif args.mode == "rerank":
+        report = bench_rerank(rag, questions, generate=not args.no_llm)
+    elif args.mode == "cascade":
+        report = bench_cascade(rag, questions)
+    elif args.mode == "detector":
+        report = bench_detector(rag)
+
+    save_report(args.output, report)
+
+if __name__ == "__main__":
+    main()
@@ -8,10 +8,10 @@ import time
 import re
 import shutil
 import argparse
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from sentence_transformers import SentenceTransformer
-import chromadb
-import numpy as np
+
+from injection_scanner import get_scanner
+from profiler import add_profile_argument, checkpoint, profiling
+from startup_profile import lazy_import, startup
 
 def batch_data(data, batch_size=4000):
     """Разбивает данные на батчи"""
@@ -26,18 +26,17 @@ def preprocess_text(text):
 
 def load_embedding_model(model_path=None, model_name=None):
     """Загрузка модели с поддержкой локального пути"""
+    get_embedding_model = lazy_import("embedding_service").get_embedding_model
     try:
         if model_path and os.path.exists(model_path):
             print(f"   📂 Загрузка локальной модели из: {model_path}")
-            model = SentenceTransformer(model_path)
+            model = get_embedding_model(model_path)
             # Получаем имя модели из пути или конфига
             model._model_name = os.path.basename(model_path)
             return model
         elif model_name:
             print(f"   🌐 Загрузка онлайн модели: {model_name}")
-            model = SentenceTransformer(model_name)
-            model._model_name = model_name
-            return model
+            return get_embedding_model(model_name)
         else:
             # Резервные варианты
             models_to_try = [
@@ -48,9 +47,7 @@ def load_embedding_model(model_path=None, model_name=None):
             for model_name in models_to_try:
                 try:
                     print(f"   🔄 Попытка загрузить: {model_name}")
-                    model = SentenceTransformer(model_name)
-                    model._model_name = model_name
-                    return model
+                    return get_embedding_model(model_name)
                 except Exception as e:
                     print(f"   ⚠️ Не удалось загрузить {model_name}: {e}")
                     continue
@@ -73,6 +70,7 @@ def create_vector_index(model_path=None, model_name=None, chunk_size=384):
     model_name = getattr(embed_model, '_model_name', 'Unknown')
     print(f"   ✅ Модель загружена: {model_name}")
     print(f"   📊 Размер эмбеддингов: {embed_model.get_sentence_embedding_dimension()} измерений")
+    checkpoint("загрузка модели")
 
     print("\n📄 Шаг 2: Загрузка и обработка документов...")
     source_folder = "knowledge_base"
@@ -84,6 +82,9 @@ def create_vector_index(model_path=None, model_name=None, chunk_size=384):
     text_files = [f for f in os.listdir(source_folder) if f.endswith(('.txt', '.md'))]
     print(f"   📁 Найдено {len(text_files)} документов")
 
+    RecursiveCharacterTextSplitter = lazy_import("langchain.text_splitter").RecursiveCharacterTextSplitter
+    scanner = get_scanner()
+
     all_chunks = []
     chunks_metadatas = []
 
@@ -115,13 +116,18 @@ def create_vector_index(model_path=None, model_name=None, chunk_size=384):
                     "title": title,
                     "chunk_id": i,
                     "start_index": chunk.metadata.get('start_index', 0),
-                    "content_length": len(chunk.page_content)
+                    "content_length": len(chunk.page_content),
+                    "flagged": scanner.is_flagged(enhanced_content)
                 })
 
         except Exception as e:
             print(f"   ⚠️ Ошибка при обработке файла {filename}: {e}")
 
     print(f"   ✅ Создано {len(all_chunks)} чанков")
+    checkpoint("разбиение на чанки")
+    flagged_count = sum(m["flagged"] for m in chunks_metadatas)
+    if flagged_count:
+        print(f"   🚫 Помечено как возможный prompt injection: {flagged_count} (исключаются из поиска)")
 
     print("\n🧮 Шаг 3: Генерация эмбеддингов...")
     start_time = time.time()
@@ -138,6 +144,7 @@ def create_vector_index(model_path=None, model_name=None, chunk_size=384):
 
         embedding_time = time.time() - start_time
         print(f"   ✅ Эмбеддинги сгенерированы за {embedding_time:.2f} секунд")
+        checkpoint("эмбеддинги")
 
     except Exception as e:
         print(f"   ❌ Ошибка генерации эмбеддингов: {e}")
@@ -154,6 +161,7 @@ def create_vector_index(model_path=None, model_name=None, chunk_size=384):
             pass
 
     try:
+        chromadb = lazy_import("chromadb")
         client = chromadb.PersistentClient(path=persist_directory)
 
         collection = client.get_or_create_collection(
@@ -162,7 +170,8 @@ def create_vector_index(model_path=None, model_name=None, chunk_size=384):
                 "hnsw:space": "cosine",
                 "model": model_name,
                 "chunk_size": str(chunk_size),
-                "embedding_dim": str(embed_model.get_sentence_embedding_dimension())
+                "embedding_dim": str(embed_model.get_sentence_embedding_dimension()),
+                "injection_patterns": scanner.signature
             }
         )
 
@@ -192,6 +201,7 @@ def create_vector_index(model_path=None, model_name=None, chunk_size=384):
             )
 
         print(f"   ✅ Векторный индекс сохранен в '{persist_directory}/'")
+        checkpoint("запись индекса")
 
         return {
             "client": client,
@@ -266,9 +276,18 @@ def main():
     parser.add_argument("--model-name", help="Название онлайн модели")
     parser.add_argument("--chunk-size", type=int, default=384, help="Размер чанков")
     parser.add_argument("--no-interactive", action="store_true", help="Не запускать интерактивный поиск")
+    parser.add_argument("--startup-profile", action="store_true", help="Показать время импорта и инициализации")
+    add_profile_argument(parser)
 
     args = parser.parse_args()
+    try:
+        with profiling(args.profile, "build_index"):
+            build(args)
+    finally:
+        if args.startup_profile:
+            startup.report()
 
+def build(args):
     print("="*80)
     print("🛠️  СОЗДАНИЕ ВЕКТОРНОГО ИНДЕКСА")
     print("="*80)
@@ -276,13 +295,17 @@ def main():
     if os.path.exists("vector_index"):
         response = input("Индекс уже существует. Пересоздать? (y/N): ").strip().lower()
         if response != 'y':
+            if args.no_interactive:
+                return
             print("Загрузка существующего индекса...")
             try:
-                client = chromadb.PersistentClient(path="vector_index")
-                collection = client.get_collection("knowledge_base")
+                chromadb = lazy_import("chromadb")
+                with startup.measure("init", "векторная БД"):
+                    client = chromadb.PersistentClient(path="vector_index")
+                    collection = client.get_collection("knowledge_base")
                 # Загружаем модель для поиска
                 embed_model = load_embedding_model(args.model_path, args.model_name)
-                if embed_model and not args.no_interactive:
+                if embed_model:
                     interactive_search(collection, embed_model)
                 return
             except Exception as e:
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+Офлайн-справки по документам базы знаний через локальную LLM
+
+    python build_summaries.py [--knowledge-base knowledge_base] [--output summaries.json] [--force]
+
+Справки хранятся по имени файла вместе с хэшем содержимого: при повторном
+запуске заново обрабатываются только новые и измененные документы.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import time
+
+from build_index import preprocess_text
+from config import config
+from injection_scanner import get_scanner
+from llm_client import LLMClient
+from prompts import SUMMARY_SYSTEM_PROMPT, build_summary_prompt
+
+def content_hash(content: str) -> str:
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+def current_summaries(summaries: dict, source_folder: str) -> dict:
+    """Справки, хэш которых совпадает с текущим содержимым документа (удаленные и измененные отбрасываются)"""
+    current = {}
+    for filename, entry in summaries.items():
+        try:
+            with open(os.path.join(source_folder, filename), 'r', encoding='utf-8') as file:
+                content = file.read()
+        except OSError:
+            continue
+        if entry.get("hash") == content_hash(content):
+            current[filename] = entry
+    return current
+
+def load_summaries(path: str) -> dict:
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def save_summaries(path: str, summaries: dict) -> None:
+    """Запись через временный файл: прерванный запуск не портит готовые справки"""
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(summaries, f, ensure_ascii=False, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
+
+def build(source_folder: str, output_path: str, model: str, force: bool = False) -> dict:
+    summaries = load_summaries(output_path)
+    text_files = sorted(f for f in os.listdir(source_folder) if f.endswith(('.txt', '.md')))
+
+    removed = set(summaries) - set(text_files)
+    for filename in removed:
+        del summaries[filename]
+
+    llm_client = LLMClient(model=model)
+    scanner = get_scanner()
+    stats = {"generated": 0, "unchanged": 0, "skipped": 0, "removed": len(removed)}
+
+    for number, filename in enumerate(text_files, 1):
+        with open(os.path.join(source_folder, filename), 'r', encoding='utf-8') as file:
+            content = file.read()
+        digest = content_hash(content)
+
+        entry = summaries.get(filename)
+        if not force and entry and entry["hash"] == digest and entry["model"] == model:
+            stats["unchanged"] += 1
+            continue
+
+        title = os.path.splitext(filename)[0].replace('_', ' ')
+        if scanner.is_flagged(content):
+            # Справка по такому документу может пересказать команды или секреты
+            print(f"   🚫 [{number}/{len(text_files)}] {filename}: пропущен (prompt injection)")
+            summaries.pop(filename, None)
+            stats["skipped"] += 1
+            continue
+
+        start_time = time.time()
+        text = preprocess_text(content)[:config.SUMMARY_MAX_INPUT_CHARS]
+        summary, llm_stats = llm_client.generate_with_stats(
+            build_summary_prompt(title, text), system_prompt=SUMMARY_SYSTEM_PROMPT
+        )
+        if not llm_stats:  # ошибка LLM: статистики в ответе нет
+            print(f"   ⚠️ [{number}/{len(text_files)}] {filename}: {summary}")
+            stats["skipped"] += 1
+            continue
+
+        summaries[filename] = {"title": title, "hash": digest, "model": model, "summary": summary.strip()}
+        save_summaries(output_path, summaries)
+        stats["generated"] += 1
+        print(f"   ✅ [{number}/{len(text_files)}] {filename} ({time.time() - start_time:.1f} сек)")
+
+    save_summaries(output_path, summaries)
+    return stats
+
+def main():
+    parser = argparse.ArgumentParser(description="Офлайн-справки по документам базы знаний")
+    parser.add_argument("--knowledge-base", default=config.SUMMARIES_SOURCE_FOLDER, help="Папка с документами")
+    parser.add_argument("--output", default=config.SUMMARIES_PATH, help="JSON-файл справок")
+    parser.add_argument("--model", default=config.LLM_MODEL, help="Модель Ollama")
+    parser.add_argument("--force", action="store_true", help="Пересоздать все справки")
+    args = parser.parse_args()
+
+    print("="*80)
+    print("📝 СПРАВКИ ПО ДОКУМЕНТАМ")
+    print("="*80)
+
+    if not os.path.exists(args.knowledge_base):
+        print(f"❌ Ошибка: Папка '{args.knowledge_base}' не найдена!")
+        return
+
+    stats = build(args.knowledge_base, args.output, args.model, args.force)
+    print(f"\n💾 Справки сохранены в: {args.output}")
+    print(f"   Создано: {stats['generated']}, без изменений: {stats['unchanged']}, "
+          f"пропущено: {stats['skipped']}, удалено: {stats['removed']}")
+
+if __name__ == "__main__":
+    main()
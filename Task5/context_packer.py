@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+Упаковка контекста в бюджет токенов: заголовок документа один раз,
+склейка перекрывающихся чанков одного файла, отбор по релевантности
+"""
+
+import re
+from functools import lru_cache
+from typing import Dict, List
+
+from config import config
+from startup_profile import lazy_import
+
+TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+
+@lru_cache(maxsize=1)
+def load_tokenizer(name: str):
+    AutoTokenizer = lazy_import("transformers").AutoTokenizer
+    return AutoTokenizer.from_pretrained(name)
+
+def count_tokens(text: str) -> int:
+    """Число токенов: токенизатор LLM (config.CONTEXT_TOKENIZER) или локальная оценка"""
+    if config.CONTEXT_TOKENIZER:
+        return len(load_tokenizer(config.CONTEXT_TOKENIZER).encode(text, add_special_tokens=False))
+
+    # Оценка: знак препинания - один токен, слово - примерно по токену на CHARS_PER_TOKEN символов
+    return sum(
+        -(-len(piece) // config.CHARS_PER_TOKEN) if piece[0].isalnum() or piece[0] == "_" else 1
+        for piece in TOKEN_PATTERN.findall(text)
+    )
+
+def split_header(document: str):
+    """Чанк из build_index.py: 'Документ: X\\nТема: X\\n\\nтекст' -> (X, текст)"""
+    if document.startswith("Документ: ") and "\n\n" in document:
+        header, body = document.split("\n\n", 1)
+        return header.splitlines()[0][len("Документ: "):].strip(), body
+    return None, document
+
+def merge_segments(chunks: List[Dict]) -> List[str]:
+    """Склейка чанков одного документа по start_index с удалением перекрытия"""
+    positioned = []
+    for chunk in chunks:
+        _, body = split_header(chunk["text"])
+        start = chunk["metadata"].get("start_index")
+        positioned.append((start if start is not None else float("inf"), body))
+    positioned.sort(key=lambda item: item[0])
+
+    segments = []
+    current_end = None
+    for start, body in positioned:
+        if current_end is not None and start <= current_end + 1:
+            # Перекрытие отрезается; пропущенный между соседними чанками пробел восстанавливается
+            segments[-1] += body[current_end - start:] if start <= current_end else " " + body
+            current_end = max(current_end, start + len(body))
+        else:
+            segments.append(body)
+            current_end = start + len(body) if start != float("inf") else None
+    return segments
+
+def render(chunks: List[Dict]) -> List[str]:
+    """Блоки контекста: по одному на документ, документы в порядке лучшего чанка"""
+    groups: Dict[str, List[Dict]] = {}
+    for chunk in chunks:
+        source = chunk["metadata"].get("source") or chunk["id"]
+        groups.setdefault(source, []).append(chunk)
+
+    blocks = []
+    for group in groups.values():
+        title, _ = split_header(group[0]["text"])
+        title = title or group[0]["metadata"].get("title")
+        body = " … ".join(merge_segments(group))
+        blocks.append(f"Документ: {title}\n{body}" if title else body)
+    return blocks
+
+def pack_context(chunks: List[Dict], budget: int = None) -> List[str]:
+    """
+    Жадно добавляет чанки в порядке релевантности, пока упакованный контекст
+    помещается в бюджет токенов. Самый релевантный чанк берется всегда.
+    """
+    budget = budget or config.CONTEXT_TOKEN_BUDGET
+
+    selected: List[Dict] = []
+    for chunk in chunks:
+        candidate = selected + [chunk]
+        if selected and sum(count_tokens(block) for block in render(candidate)) > budget:
+            continue
+        selected = candidate
+    return render(selected)
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""
+Динамический микробатчинг эмбеддингов запросов
+"""
+
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import List
+
+import numpy as np
+
+from config import config
+from metrics import metrics
+
+class EmbeddingBatcher:
+    """
+    Собирает тексты от параллельных вызовов encode() в течение max_wait_ms
+    или до max_batch_size штук, кодирует одним батчем и раздает векторы
+    ожидающим вызовам. Интерфейс совместим с model.encode(texts).
+    """
+
+    def __init__(self, model, max_batch_size: int = None, max_wait_ms: float = None):
+        self.model = model
+        self.max_batch_size = max_batch_size or config.EMBED_MICROBATCH_MAX_SIZE
+        self.max_wait = (max_wait_ms if max_wait_ms is not None else config.EMBED_MICROBATCH_MAX_WAIT_MS) / 1000
+        self.requests: "queue.Queue" = queue.Queue()
+        self.worker = threading.Thread(target=self.run, name="embedding-batcher", daemon=True)
+        self.worker.start()
+
+    def encode(self, texts: List[str], **kwargs) -> np.ndarray:
+        futures = []
+        for text in texts:
+            future = Future()
+            self.requests.put((text, future))
+            futures.append(future)
+        return np.stack([future.result() for future in futures])
+
+    def collect_batch(self) -> list:
+        batch = [self.requests.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self.requests.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+    def run(self) -> None:
+        while True:
+            batch = self.collect_batch()
+            metrics.observe("embedding_batch_size", len(batch))
+            try:
+                vectors = self.model.encode([text for text, _ in batch], batch_size=len(batch))
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+
+            for (_, future), vector in zip(batch, vectors):
+                future.set_result(vector)
@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+"""
+Локальный сервис эмбеддингов на Unix-сокете: одна прогретая модель
+для build_index.py, test_index.py, test_index_int.py и main.py
+
+Запуск:
+    python embedding_service.py [--model-name ...] [--socket $XDG_RUNTIME_DIR/rag_embeddings.sock]
+
+Скрипты получают модель через get_embedding_model(): если сервис с той же
+моделью запущен - используется он, иначе модель загружается в процессе.
+Сокет доступен только владельцу (0600, каталог 0700), клиенты подключаются
+только к сокету, принадлежащему тому же пользователю.
+При EMBEDDING_BACKEND = "fake" вместо модели используются хэш-эмбеддинги.
+"""
+
+import argparse
+import json
+import os
+import signal
+import socket
+import socketserver
+import stat
+import struct
+import sys
+import threading
+from typing import List
+
+import numpy as np
+
+from config import config
+from startup_profile import lazy_import, startup
+
+HEADER = struct.Struct(">I")
+
+def send_message(sock, header: dict, payload: bytes = b"") -> None:
+    data = json.dumps(header, ensure_ascii=False).encode("utf-8")
+    sock.sendall(HEADER.pack(len(data)) + data + payload)
+
+def recv_exact(sock, size: int) -> bytes:
+    buffer = bytearray()
+    while len(buffer) < size:
+        chunk = sock.recv(size - len(buffer))
+        if not chunk:
+            raise ConnectionError("Соединение с сервисом эмбеддингов закрыто")
+        buffer.extend(chunk)
+    return bytes(buffer)
+
+def recv_message(sock):
+    (length,) = HEADER.unpack(recv_exact(sock, HEADER.size))
+    header = json.loads(recv_exact(sock, length))
+    payload = recv_exact(sock, header.get("nbytes", 0))
+    return header, payload
+
+class EmbeddingRequestHandler(socketserver.BaseRequestHandler):
+    model = None       # SentenceTransformer, задается в serve
+    model_name = None
+
+    def handle(self):
+        while True:
+            try:
+                request, _ = recv_message(self.request)
+            except (ConnectionError, struct.error):
+                return
+
+            try:
+                if request.get("op") == "info":
+                    send_message(self.request, {
+                        "model": self.model_name,
+                        "dimension": self.model.get_sentence_embedding_dimension()
+                    })
+                elif request.get("op") == "encode":
+                    vectors = self.model.encode(
+                        request["texts"],
+                        batch_size=request.get("batch_size", 32),
+                        normalize_embeddings=request.get("normalize_embeddings", False),
+                        convert_to_numpy=True
+                    ).astype(np.float32)
+                    payload = vectors.tobytes()
+                    send_message(self.request, {"shape": list(vectors.shape), "nbytes": len(payload)}, payload)
+                else:
+                    send_message(self.request, {"error": f"Неизвестная операция: {request.get('op')}"})
+            except Exception as e:
+                send_message(self.request, {"error": str(e)})
+
+class EmbeddingServiceClient:
+    """Клиент сервиса с интерфейсом SentenceTransformer.encode"""
+
+    def __init__(self, socket_path: str = None):
+        self.socket_path = socket_path or config.EMBEDDING_SOCKET_PATH
+        self.local = threading.local()  # по соединению на поток
+        info, _ = self.call({"op": "info"})
+        self._model_name = info["model"]
+        self.dimension = info["dimension"]
+
+    def connection(self):
+        if getattr(self.local, "sock", None) is None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.connect(self.socket_path)
+            self.local.sock = sock
+        return self.local.sock
+
+    def call(self, request: dict):
+        sock = self.connection()
+        try:
+            send_message(sock, request)
+            header, payload = recv_message(sock)
+        except OSError:
+            sock.close()
+            self.local.sock = None
+            raise
+        if "error" in header:
+            raise RuntimeError(f"Сервис эмбеддингов: {header['error']}")
+        return header, payload
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.dimension
+
+    def encode(self, texts: List[str], batch_size: int = 32, normalize_embeddings: bool = False, **kwargs) -> np.ndarray:
+        single = isinstance(texts, str)
+        header, payload = self.call({
+            "op": "encode",
+            "texts": [texts] if single else list(texts),
+            "batch_size": batch_size,
+            "normalize_embeddings": normalize_embeddings
+        })
+        vectors = np.frombuffer(payload, dtype=np.float32).reshape(header["shape"])
+        return vectors[0] if single else vectors
+
+def owned_socket(path: str) -> bool:
+    """Путь - Unix-сокет текущего пользователя (чужой сервис может вернуть произвольные векторы)"""
+    try:
+        st = os.lstat(path)
+    except OSError:
+        return False
+    return stat.S_ISSOCK(st.st_mode) and st.st_uid == os.getuid()
+
+def prepare_socket_dir(socket_path: str) -> None:
+    """
+    Каталог сокета создается с правами 0700. Каталог другого пользователя или доступный
+    на запись всем без sticky-бита не используется: в нем сокет могут подменить
+    """
+    directory = os.path.dirname(os.path.abspath(socket_path))
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    st = os.lstat(directory)
+    if not stat.S_ISDIR(st.st_mode) or st.st_uid not in (os.getuid(), 0):
+        raise PermissionError(f"Каталог {directory} принадлежит другому пользователю")
+    if st.st_mode & 0o022 and not st.st_mode & stat.S_ISVTX:
+        raise PermissionError(f"Каталог {directory} доступен на запись другим пользователям")
+
+def connect_embedding_service(model_name: str):
+    """Клиент запущенного сервиса с нужной моделью или None"""
+    if not config.EMBEDDING_SERVICE_ENABLED or config.EMBEDDING_BACKEND == "fake" or not hasattr(socket, "AF_UNIX"):
+        return None
+    if not os.path.exists(config.EMBEDDING_SOCKET_PATH):
+        return None
+    if not owned_socket(config.EMBEDDING_SOCKET_PATH):
+        print(f"   ⚠️ {config.EMBEDDING_SOCKET_PATH} не является сокетом текущего пользователя, сервис не используется")
+        return None
+    try:
+        client = EmbeddingServiceClient()
+    except (OSError, ValueError, RuntimeError):
+        return None
+    if client._model_name != model_name:
+        print(f"   ⚠️ Сервис эмбеддингов обслуживает {client._model_name}, а нужна {model_name}")
+        return None
+    return client
+
+def load_local_model(model_name: str):
+    """Модель в процессе: SentenceTransformer или хэш-эмбеддинги (EMBEDDING_BACKEND)"""
+    if config.EMBEDDING_BACKEND == "fake":
+        HashEmbeddingModel = lazy_import("fake_embeddings").HashEmbeddingModel
+        print(f"   🧪 Хэш-эмбеддинги вместо {model_name} (EMBEDDING_BACKEND=fake)")
+        return HashEmbeddingModel(model_name)
+    if config.EMBEDDING_BACKEND != "sentence_transformers":
+        raise ValueError(f"Неизвестный EMBEDDING_BACKEND: {config.EMBEDDING_BACKEND}")
+
+    SentenceTransformer = lazy_import("sentence_transformers").SentenceTransformer
+    with startup.measure("init", f"модель эмбеддингов {model_name}"):
+        model = SentenceTransformer(model_name)
+    model._model_name = model_name
+    return model
+
+def get_embedding_model(model_name: str = None):
+    """Модель эмбеддингов: сервис на Unix-сокете, если доступен, иначе загрузка в процессе"""
+    model_name = model_name or config.EMBEDDING_MODEL
+
+    client = connect_embedding_service(model_name)
+    if client is not None:
+        print(f"   🔌 Используется сервис эмбеддингов: {config.EMBEDDING_SOCKET_PATH}")
+        return client
+
+    return load_local_model(model_name)
+
+def serve(model_name: str, socket_path: str) -> None:
+    try:
+        prepare_socket_dir(socket_path)
+    except PermissionError as e:
+        print(f"❌ {e}: укажите другой путь (--socket или RAG_EMBEDDING_SOCKET)")
+        return
+
+    if os.path.lexists(socket_path):
+        if not owned_socket(socket_path):
+            print(f"❌ {socket_path} существует и не является сокетом текущего пользователя")
+            return
+        try:
+            EmbeddingServiceClient(socket_path)
+            print(f"❌ Сервис уже запущен на {socket_path}")
+            return
+        except OSError:
+            os.remove(socket_path)  # сокет остался от упавшего процесса
+
+    print(f"🔄 Загрузка модели: {model_name}")
+    handler = type("BoundEmbeddingRequestHandler", (EmbeddingRequestHandler,), {
+        "model": load_local_model(model_name),
+        "model_name": model_name
+    })
+
+    server = socketserver.ThreadingUnixStreamServer(socket_path, handler)
+    os.chmod(socket_path, 0o600)
+    server.daemon_threads = True
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))  # удалить сокет и при SIGTERM
+    print(f"🔌 Сервис эмбеддингов запущен: {socket_path} (Ctrl+C для остановки)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n👋 Сервис остановлен")
+    finally:
+        server.server_close()
+        os.remove(socket_path)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Сервис эмбеддингов на Unix-сокете")
+    parser.add_argument("--model-name", default=config.EMBEDDING_MODEL, help="Название или путь модели")
+    parser.add_argument("--socket", default=config.EMBEDDING_SOCKET_PATH, help="Путь к Unix-сокету")
+    args = parser.parse_args()
+
+    serve(args.model_name, args.socket)
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+Извлекающий ответ без LLM: для простых вопросов "Кто такой X?" / "Что такое X?"
+выбираются предложения лучшего чанка, в которых упоминается X
+"""
+
+import re
+from typing import List, Optional, Tuple
+
+from context_packer import split_header
+
+SIMPLE_QUESTION = re.compile(
+    r"^\s*(кто|что)\s+(?:так(?:ой|ая|ое|ие)|есть)\s+(?P<entity>[^?]+?)\s*\??\s*$",
+    re.IGNORECASE
+)
+SENTENCE_SPLIT = re.compile(r"(?<=[.!?])\s+|\s*-{3,}\s*")  # конец предложения или линия-разделитель
+TITLE_LINE = re.compile(r"^\s*Заголовок:[^.!?]*?(?=-{3,})")  # "Заголовок: X ----" в начале файла
+WORD = re.compile(r"\w+")
+DEFINITION_MARKERS = (" - ", " это ", " является ", " являлся ", " являлась ", " или ", " также известн")
+
+def parse_simple_question(question: str) -> Optional[Tuple[str, str]]:
+    """('character' | 'general', сущность) для вопросов-определений, иначе None"""
+    match = SIMPLE_QUESTION.match(question)
+    if not match:
+        return None
+    kind = "character" if match.group(1).lower() == "кто" else "general"
+    return kind, match.group("entity").strip()
+
+def stems(text: str) -> List[str]:
+    """Грубые основы слов: без окончаний, чтобы 'Шкайзюкера' совпало с 'Шкайзюкер'"""
+    return [word[:max(4, len(word) - 2)] for word in WORD.findall(text.lower())]
+
+def entity_coverage(entity_stems: List[str], text: str) -> float:
+    """Доля основ сущности, встречающихся в тексте"""
+    if not entity_stems:
+        return 0.0
+    words = stems(text)
+    return sum(1 for stem in entity_stems if any(word.startswith(stem) for word in words)) / len(entity_stems)
+
+def score_sentence(sentence: str, entity_stems: List[str], position: int) -> Tuple[float, float]:
+    """(доля основ сущности в предложении, итоговая оценка с бонусами за определение и позицию)"""
+    coverage = entity_coverage(entity_stems, sentence)
+    lowered = f" {sentence.lower()} "
+    score = coverage * 2
+    score += 0.5 if any(marker in lowered for marker in DEFINITION_MARKERS) else 0
+    score += 0.3 / (1 + position)
+    return coverage, score
+
+def extract_answer(entity: str, text: str, max_sentences: int = 2) -> Optional[str]:
+    """Лучшие предложения текста о сущности в исходном порядке или None, если сущность не упомянута"""
+    entity_stems = stems(entity)
+    if not entity_stems:
+        return None
+
+    _, body = split_header(text)
+    body = TITLE_LINE.sub("", body)
+    sentences = [" ".join(s.split()) for s in SENTENCE_SPLIT.split(body) if len(s.strip()) > 20]
+
+    scored = []
+    for position, sentence in enumerate(sentences):
+        coverage, score = score_sentence(sentence, entity_stems, position)
+        if coverage >= 0.5:
+            scored.append((score, position, sentence))
+    if not scored:
+        return None
+
+    best = sorted(scored, reverse=True)[:max_sentences]
+    return " ".join(sentence for _, _, sentence in sorted(best, key=lambda item: item[1]))
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+Детерминированная модель эмбеддингов без весов для офлайн-запусков и замеров:
+признаки - хэшированные символьные n-граммы слов и сами слова (feature hashing),
+вектор той же размерности, что у основной модели, нормирован.
+
+Включается через EMBEDDING_BACKEND = "fake" (или RAG_EMBEDDING_BACKEND=fake):
+get_embedding_model() вернет HashEmbeddingModel вместо SentenceTransformer.
+Тексты с общими словами и основами получают близкие векторы, поэтому поиск
+по индексу остается осмысленным, хотя и грубее настоящей модели.
+"""
+
+import hashlib
+import re
+import time
+from functools import lru_cache
+from typing import List, Tuple, Union
+
+import numpy as np
+
+from config import config
+
+WORD = re.compile(r"\w+")
+NGRAM_SIZES = (3, 4, 5)
+
+@lru_cache(maxsize=200000)
+def feature_slot(feature: str, dimension: int) -> Tuple[int, float]:
+    """Индекс и знак признака: стабильный хэш, не зависящий от PYTHONHASHSEED"""
+    digest = int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "little")
+    return digest % dimension, 1.0 if (digest >> 63) & 1 else -1.0
+
+def features(text: str) -> List[str]:
+    """Слова и символьные n-граммы слов с маркерами границ, как в fastText"""
+    result = []
+    for word in WORD.findall(text.lower()):
+        result.append(word)
+        marked = f"<{word}>"
+        for size in NGRAM_SIZES:
+            result.extend(marked[i:i + size] for i in range(len(marked) - size + 1))
+    return result
+
+class HashEmbeddingModel:
+    """Интерфейс SentenceTransformer.encode / get_sentence_embedding_dimension без загрузки весов"""
+
+    def __init__(self, model_name: str = None, dimension: int = None,
+                 batch_latency_ms: float = None, text_latency_ms: float = None):
+        self._model_name = f"fake-hash/{model_name or config.EMBEDDING_MODEL}"
+        self.dimension = dimension or config.EMBEDDING_DIMENSION
+        # Имитация времени модели: фиксированная цена батча и добавка за каждый текст
+        self.batch_latency_ms = config.FAKE_EMBEDDING_BATCH_LATENCY_MS if batch_latency_ms is None else batch_latency_ms
+        self.text_latency_ms = config.FAKE_EMBEDDING_TEXT_LATENCY_MS if text_latency_ms is None else text_latency_ms
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.dimension
+
+    def embed(self, text: str) -> np.ndarray:
+        vector = np.zeros(self.dimension, dtype=np.float32)
+        for feature in features(text):
+            index, sign = feature_slot(feature, self.dimension)
+            vector[index] += sign
+        norm = np.linalg.norm(vector)
+        if norm > 0:
+            vector /= norm
+        return vector
+
+    def encode(self, texts: Union[str, List[str]], batch_size: int = 32, **kwargs) -> np.ndarray:
+        """Векторы всегда нормированы; остальные параметры SentenceTransformer.encode игнорируются"""
+        single = isinstance(texts, str)
+        texts = [texts] if single else list(texts)
+
+        vectors = np.zeros((len(texts), self.dimension), dtype=np.float32)
+        for start in range(0, len(texts), batch_size):
+            batch = texts[start:start + batch_size]
+            delay = (self.batch_latency_ms + self.text_latency_ms * len(batch)) / 1000
+            if delay > 0:
+                time.sleep(delay)
+            for offset, text in enumerate(batch):
+                vectors[start + offset] = self.embed(text)
+        return vectors[0] if single else vectors
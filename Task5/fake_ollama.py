@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+"""
+Локальная заглушка Ollama (/api/generate) для запуска и замеров без GPU
+
+Запуск:
+    python fake_ollama.py --port 11434
+    python fake_ollama.py --prefill-ms 0.5 --decode-rate 20 --concurrency 1 --failure-rate 0.05
+    OLLAMA_URL=http://127.0.0.1:11434 python main.py --serve
+
+Профиль задержек (FakeProfile) имитирует поведение Ollama, от которого зависят
+оптимизации LLMClient:
+    - prefill: prefill_ms на каждый токен промпта, кроме совпавшего префикса
+      прошлого запроса к той же модели и переданного массива context;
+    - decode: decode_rate токенов в секунду, ответ обрезается по num_predict;
+    - загрузка модели: load_ms при первом запросе и после простоя дольше keep_alive;
+    - одновременно обслуживается concurrency запросов, остальные ждут в очереди
+      (не больше max_queue, иначе 503, как OLLAMA_MAX_QUEUE);
+    - failure_rate: доля запросов, завершающихся ошибкой 500 или обрывом соединения
+      (посреди потока либо без ответа для stream=false);
+    - "установлены" только модели из models (по умолчанию LLM_MODEL и LLM_SMALL_MODEL):
+      они перечислены в /api/tags, на остальные /api/generate отвечает 404.
+Ответы и последовательность сбоев детерминированы (seed).
+"""
+
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+
+from config import config
+
+def fake_answer(prompt: str) -> str:
+    """Детерминированный ответ, зависящий только от промпта"""
+    question = prompt.strip().splitlines()[-1] if prompt.strip() else ""
+    return f"Тестовый ответ ({len(prompt)} символов промпта). {question}".strip()
+
+def fake_tokens(text: str) -> list:
+    """Псевдотокены для массива context: по одному на слово"""
+    return [sum(map(ord, word)) % 32000 for word in text.split()]
+
+def parse_keep_alive(value) -> Optional[float]:
+    """keep_alive Ollama в секундах: 300, "30s", "5m", "1h"; None - держать всегда (отрицательное значение)"""
+    if value is None:
+        return 300.0
+    if isinstance(value, (int, float)):
+        return None if value < 0 else float(value)
+    match = re.fullmatch(r"\s*(-?\d+(?:\.\d+)?)\s*([smh]?)\s*", str(value))
+    if not match:
+        return 300.0
+    seconds = float(match.group(1)) * {"": 1, "s": 1, "m": 60, "h": 3600}[match.group(2)]
+    return None if seconds < 0 else seconds
+
+def common_prefix(left: List[int], right: List[int]) -> int:
+    length = 0
+    for a, b in zip(left, right):
+        if a != b:
+            break
+        length += 1
+    return length
+
+class FakeProfile:
+    """Параметры задержек и сбоев заглушки и ее состояние (загруженные модели, кэш префикса)"""
+
+    def __init__(self, prefill_ms: float = 0.0, decode_rate: float = 0.0, load_ms: float = 0.0,
+                 concurrency: int = 0, max_queue: int = 512, failure_rate: float = 0.0, seed: int = 0,
+                 models: List[str] = None):
+        self.prefill_ms = prefill_ms        # мс на токен промпта вне кэша
+        self.decode_rate = decode_rate      # токенов ответа в секунду, 0 - без задержки
+        self.load_ms = load_ms              # загрузка модели в память
+        self.concurrency = concurrency      # одновременных запросов, 0 - без ограничения
+        self.max_queue = max_queue
+        self.failure_rate = failure_rate
+        self.models = list(models or (config.LLM_MODEL, config.LLM_SMALL_MODEL))
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.slots = threading.Semaphore(concurrency) if concurrency > 0 else None
+        self.waiting = 0
+        self.loaded: Dict[str, float] = {}            # модель -> время, до которого она в памяти
+        self.cached_prompt: Dict[str, List[int]] = {}  # модель -> токены последнего запроса (KV-кэш)
+
+    def acquire(self) -> bool:
+        """Слот обработки; False - очередь переполнена"""
+        if self.slots is None:
+            return True
+        with self.lock:
+            if self.waiting >= self.max_queue:
+                return False
+            self.waiting += 1
+        self.slots.acquire()
+        with self.lock:
+            self.waiting -= 1
+        return True
+
+    def release(self) -> None:
+        if self.slots is not None:
+            self.slots.release()
+
+    def failure(self) -> Optional[str]:
+        """'error' (HTTP 500), 'drop' (обрыв соединения) или None"""
+        with self.lock:
+            if self.failure_rate <= 0 or self.rng.random() >= self.failure_rate:
+                return None
+            return self.rng.choice(("error", "drop"))
+
+    def load(self, model: str, keep_alive) -> float:
+        """Время загрузки модели, сек: 0, если модель еще в памяти"""
+        now = time.monotonic()
+        ttl = parse_keep_alive(keep_alive)
+        with self.lock:
+            needed = self.loaded.get(model, 0.0) < now
+            self.loaded[model] = float("inf") if ttl is None else now + ttl
+        return self.load_ms / 1000 if needed else 0.0
+
+    def prefill(self, model: str, sequence: List[int], answer: List[int]) -> int:
+        """
+        Токены context + промпт, которых нет в KV-кэше модели (общий префикс с прошлым
+        запросом не вычисляется); после ответа в кэше остается вся последовательность
+        """
+        with self.lock:
+            cached = common_prefix(self.cached_prompt.get(model, []), sequence)
+            self.cached_prompt[model] = sequence + answer
+        return len(sequence) - cached
+
+class FakeOllamaHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    @property
+    def profile(self) -> FakeProfile:
+        return self.server.profile
+
+    def handle(self):
+        try:
+            super().handle()
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True  # клиент оборвал соединение (таймаут, дедлайн) - не ошибка заглушки
+
+    def send_json(self, status: int, payload: dict) -> None:
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_chunk(self, payload: dict) -> None:
+        data = (json.dumps(payload, ensure_ascii=False) + "\n").encode("utf-8")
+        self.wfile.write(f"{len(data):X}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def do_GET(self):
+        if self.path != "/api/tags":
+            self.send_json(404, {"error": "not found"})
+            return
+        self.send_json(200, {"models": [{"name": name, "model": name} for name in self.profile.models]})
+
+    def do_POST(self):
+        if self.path != "/api/generate":
+            self.send_json(404, {"error": "not found"})
+            return
+
+        length = int(self.headers.get("Content-Length", 0))
+        payload = json.loads(self.rfile.read(length) or b"{}")
+        if payload.get("model", "fake") not in self.profile.models:
+            self.send_json(404, {"error": f"model '{payload.get('model')}' not found, try pulling it first"})
+            return
+
+        if not self.profile.acquire():
+            self.send_json(503, {"error": "server busy, please try again. maximum pending requests exceeded"})
+            return
+        try:
+            self.generate(payload)
+        finally:
+            self.profile.release()
+
+    def generate(self, payload: dict) -> None:
+        started = time.perf_counter()
+        profile = self.profile
+        model = payload.get("model", "fake")
+        options = payload.get("options") or {}
+        failure = profile.failure()
+        if failure == "error":
+            self.send_json(500, {"error": "fake failure"})
+            return
+
+        load_seconds = profile.load(model, payload.get("keep_alive"))
+        time.sleep(load_seconds)
+
+        # Как в Ollama: context продолжает переданный диалог новым промптом и ответом
+        context = list(payload.get("context") or [])
+        new_tokens = fake_tokens(payload.get("system", "") + " " + payload.get("prompt", ""))
+        words = fake_answer(payload.get("prompt", "")).split(" ")
+        if options.get("num_predict", -1) >= 0:
+            words = words[:options["num_predict"]]
+        answer = " ".join(words)
+
+        prompt_eval_count = profile.prefill(model, context + new_tokens, fake_tokens(answer))
+        prefill_seconds = prompt_eval_count * profile.prefill_ms / 1000
+        time.sleep(prefill_seconds)
+        token_seconds = 1 / profile.decode_rate if profile.decode_rate > 0 else 0.0
+
+        def final(eval_seconds: float) -> dict:
+            return {
+                "model": model,
+                "done": True,
+                "total_duration": int((time.perf_counter() - started) * 1e9),
+                "load_duration": int(load_seconds * 1e9),
+                "prompt_eval_count": prompt_eval_count,
+                "prompt_eval_duration": int(prefill_seconds * 1e9),
+                "eval_count": len(words),
+                "eval_duration": int(eval_seconds * 1e9),
+                "context": context + new_tokens + fake_tokens(answer)
+            }
+
+        if not payload.get("stream", True):
+            time.sleep(token_seconds * len(words))
+            if failure == "drop":
+                self.close_connection = True  # соединение закрывается без ответа
+                return
+            self.send_json(200, dict(final(token_seconds * len(words)), response=answer))
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        decode_started = time.perf_counter()
+        for number, word in enumerate(words):
+            if failure == "drop" and number == len(words) // 2:
+                self.close_connection = True  # поток обрывается без финального сообщения
+                return
+            time.sleep(token_seconds)
+            self.send_chunk({"model": model, "response": word + " ", "done": False})
+        self.send_chunk(dict(final(time.perf_counter() - decode_started), response=""))
+        self.wfile.write(b"0\r\n\r\n")
+
+    def log_message(self, format, *args):
+        pass
+
+def create_fake_ollama(host: str = "127.0.0.1", port: int = 0, profile: FakeProfile = None) -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer((host, port), FakeOllamaHandler)
+    server.daemon_threads = True
+    server.profile = profile or FakeProfile()
+    return server
+
+def start_fake_ollama(host: str = "127.0.0.1", port: int = 0, profile: FakeProfile = None) -> ThreadingHTTPServer:
+    """Запуск заглушки в фоновом потоке; адрес в server.server_address"""
+    server = create_fake_ollama(host, port, profile)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Заглушка Ollama API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11434)
+    parser.add_argument("--prefill-ms", type=float, default=0.0, help="мс на токен промпта вне кэша префикса")
+    parser.add_argument("--decode-rate", type=float, default=0.0, help="токенов ответа в секунду (0 - мгновенно)")
+    parser.add_argument("--load-ms", type=float, default=0.0, help="загрузка модели после простоя дольше keep_alive")
+    parser.add_argument("--concurrency", type=int, default=0, help="одновременных запросов (0 - без ограничения)")
+    parser.add_argument("--max-queue", type=int, default=512, help="запросов в очереди, сверх - 503")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="доля запросов с ошибкой 500 или обрывом")
+    parser.add_argument("--seed", type=int, default=0, help="зерно последовательности сбоев")
+    parser.add_argument("--models", default=None, help="установленные модели через запятую (по умолчанию из config)")
+    args = parser.parse_args()
+
+    profile = FakeProfile(args.prefill_ms, args.decode_rate, args.load_ms, args.concurrency,
+                          args.max_queue, args.failure_rate, args.seed,
+                          args.models.split(",") if args.models else None)
+    server = create_fake_ollama(args.host, args.port, profile)
+    print(f"🧪 Заглушка Ollama: http://{args.host}:{args.port}/api/generate")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+Детектор prompt injection по эмбеддингам: векторы чанков из коллекции
+сравниваются с центроидами известных примеров атак одним матричным умножением
+"""
+
+import threading
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+from config import config
+from metrics import metrics
+from tracing import annotate
+
+class InjectionDetector:
+    """
+    Банк центроидов строится из config.INJECTION_EXAMPLES при первом вызове
+    (одно кодирование примеров), вердикты кэшируются по id чанка: векторы
+    в индексе не меняются, поэтому каждый чанк проверяется один раз за процесс.
+    """
+
+    def __init__(self, embed_model, examples: Dict[str, List[str]] = None, threshold: float = None):
+        self.embed_model = embed_model
+        self.examples = examples or config.INJECTION_EXAMPLES
+        self.threshold = threshold if threshold is not None else config.INJECTION_SIMILARITY_THRESHOLD
+        self.categories: List[str] = []
+        self._centroids: Optional[np.ndarray] = None
+        self.verdicts: Dict[str, Optional[str]] = {}  # id чанка -> категория атаки или None
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def normalize(vectors: np.ndarray) -> np.ndarray:
+        norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-12)
+
+    @property
+    def centroids(self) -> np.ndarray:
+        """Матрица (категории x размерность) нормированных центроидов"""
+        if self._centroids is None:
+            with self.lock:
+                if self._centroids is None:
+                    categories = list(self.examples)
+                    texts = [text for category in categories for text in self.examples[category]]
+                    vectors = self.normalize(np.asarray(self.embed_model.encode(texts), dtype=np.float32))
+
+                    centroids, offset = [], 0
+                    for category in categories:
+                        count = len(self.examples[category])
+                        centroids.append(vectors[offset:offset + count].mean(axis=0))
+                        offset += count
+                    self.categories = categories
+                    self._centroids = self.normalize(np.stack(centroids))
+        return self._centroids
+
+    def classify(self, chunks: List[Dict],
+                 fetch_embeddings: Callable[[List[str]], Dict[str, List[float]]] = None) -> Dict[str, Optional[str]]:
+        """
+        Категория атаки (или None) для каждого чанка. Векторы берутся из chunk["embedding"],
+        недостающие - через fetch_embeddings(ids) -> {id: вектор}.
+        """
+        unseen = [chunk for chunk in chunks if chunk["id"] not in self.verdicts]
+        annotate(detector_cache_hits=len(chunks) - len(unseen))
+        metrics.inc('cache_lookups_total{cache="injection_detector"}', len(chunks))
+        metrics.inc('cache_hits_total{cache="injection_detector"}', len(chunks) - len(unseen))
+        if unseen:
+            missing = [chunk["id"] for chunk in unseen if chunk.get("embedding") is None]
+            fetched = fetch_embeddings(missing) if missing and fetch_embeddings else {}
+
+            checked = [chunk for chunk in unseen
+                       if chunk.get("embedding") is not None or chunk["id"] in fetched]
+            if checked:
+                matrix = self.normalize(np.asarray(
+                    [chunk["embedding"] if chunk.get("embedding") is not None else fetched[chunk["id"]]
+                     for chunk in checked],
+                    dtype=np.float32
+                ))
+                similarity = matrix @ self.centroids.T
+                best = similarity.argmax(axis=1)
+                for chunk, index, row in zip(checked, best, similarity):
+                    category = self.categories[index] if row[index] >= self.threshold else None
+                    self.verdicts[chunk["id"]] = category
+                    if category:
+                        metrics.inc(f'injection_detected_total{{category="{category}"}}')
+
+        return {chunk["id"]: self.verdicts.get(chunk["id"]) for chunk in chunks}
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""
+Поиск признаков prompt injection в чанках автоматом Ахо-Корасик:
+все шаблоны из config.INJECTION_PATTERNS за один проход по тексту
+"""
+
+import hashlib
+from collections import deque
+from functools import lru_cache
+from typing import Iterable, List, Set
+
+from config import config
+
+class InjectionScanner:
+    """Автомат Ахо-Корасик по шаблонам в нижнем регистре (поиск подстрок без учета регистра)"""
+
+    def __init__(self, patterns: Iterable[str]):
+        self.patterns = sorted({p.lower() for p in patterns if p})
+        # Подпись набора шаблонов: сохраняется в метаданных индекса при сканировании
+        self.signature = hashlib.sha1("\n".join(self.patterns).encode("utf-8")).hexdigest()[:16]
+
+        self.goto = [{}]     # переходы по символу
+        self.fail = [0]      # суффиксные ссылки
+        self.output = [[]]   # шаблоны, заканчивающиеся в состоянии
+        for index, pattern in enumerate(self.patterns):
+            state = 0
+            for char in pattern:
+                if char not in self.goto[state]:
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.output.append([])
+                    self.goto[state][char] = len(self.goto) - 1
+                state = self.goto[state][char]
+            self.output[state].append(index)
+
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, child in self.goto[state].items():
+                queue.append(child)
+                fallback = self.fail[state]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[child] = self.goto[fallback].get(char, 0)
+                self.output[child] = self.output[child] + self.output[self.fail[child]]
+
+    def scan(self, text: str, first_only: bool = False) -> List[str]:
+        """Найденные в тексте шаблоны"""
+        found: Set[int] = set()
+        state = 0
+        for char in text.lower():
+            while state and char not in self.goto[state]:
+                state = self.fail[state]
+            state = self.goto[state].get(char, 0)
+            if self.output[state]:
+                found.update(self.output[state])
+                if first_only:
+                    break
+        return [self.patterns[index] for index in sorted(found)]
+
+    def is_flagged(self, text: str) -> bool:
+        return bool(self.scan(text, first_only=True))
+
+@lru_cache(maxsize=1)
+def get_scanner() -> InjectionScanner:
+    """Автомат по шаблонам из конфигурации (строится один раз на процесс)"""
+    return InjectionScanner(config.INJECTION_PATTERNS)
@@ -1,38 +1,294 @@
 # llm_client.py
 import requests
+import asyncio
+import random
 import time
 import json
+from typing import Dict, Generator, List, Optional, Tuple
+
+from requests.adapters import HTTPAdapter
 
 from config import config
+from metrics import metrics
+from tracing import record_span
+
+class DeadlineExceeded(Exception):
+    """Бюджет времени запроса исчерпан до получения ответа (в том числе во время повторов)"""
+
+class LLMError(Exception):
+    """Ответ не получен после всех повторов: HTTP-ошибка или сбой соединения"""
+
+def backoff_delay(attempt: int) -> float:
+    """Экспоненциальная задержка с полным джиттером"""
+    delay = min(config.LLM_BACKOFF_MAX, config.LLM_BACKOFF_BASE * (2 ** attempt))
+    return random.uniform(0, delay)
+
+def remaining_time(deadline_at: Optional[float]) -> Optional[float]:
+    """Остаток бюджета, сек (None - без дедлайна); DeadlineExceeded, если он исчерпан"""
+    if deadline_at is None:
+        return None
+    remaining = deadline_at - time.monotonic()
+    if remaining <= 0:
+        raise DeadlineExceeded()
+    return remaining
+
+def retry_delay(attempt: int, deadline_at: Optional[float]) -> float:
+    """Пауза перед повтором, не дальше дедлайна; DeadlineExceeded, если на повтор времени не остается"""
+    delay = backoff_delay(attempt)
+    remaining = remaining_time(deadline_at)
+    if remaining is not None and delay >= remaining:
+        raise DeadlineExceeded()
+    return delay
+
+def build_payload(model: str, prompt: str, system_prompt: str = "", stream: bool = False,
+                  context: List[int] = None, **options) -> dict:
+    """
+    Запрос к /api/generate; системный префикс передается отдельно и без изменений.
+    context - массив токенов предыдущих ходов диалога из ответа Ollama.
+    """
+    payload = {
+        "model": model,
+        "prompt": prompt.strip(),
+        "stream": stream,
+        "keep_alive": config.LLM_KEEP_ALIVE,
+        "options": {"num_ctx": config.LLM_NUM_CTX, "num_predict": config.MAX_RESPONSE_LENGTH, **options}
+    }
+    if system_prompt:
+        payload["system"] = system_prompt
+    if context:
+        payload["context"] = context
+    return payload
+
+def record_stats(result: dict) -> Dict:
+    """Статистика prefill/decode из ответа Ollama (длительности в секундах) с учетом в метриках"""
+    stats = {
+        "prompt_eval_count": result.get("prompt_eval_count", 0),
+        "prompt_eval_seconds": result.get("prompt_eval_duration", 0) / 1e9,
+        "eval_count": result.get("eval_count", 0),
+        "eval_seconds": result.get("eval_duration", 0) / 1e9,
+        "load_seconds": result.get("load_duration", 0) / 1e9
+    }
+    metrics.inc("llm_prompt_eval_tokens_total", stats["prompt_eval_count"])
+    metrics.inc("llm_prompt_eval_seconds_total", stats["prompt_eval_seconds"])
+    metrics.inc("llm_eval_tokens_total", stats["eval_count"])
+    return stats
 
 class LLMClient:
     def __init__(self, model: str = "llama3"):
         self.model = model
-        self.api_url = "http://localhost:11434/api/generate"
+        self.api_url = config.LLM_API_URL
+        self.timeout = (config.LLM_CONNECT_TIMEOUT, config.LLM_READ_TIMEOUT)
+        self.max_retries = config.LLM_MAX_RETRIES
+
+        # Пул keep-alive соединений: TCP-рукопожатие не повторяется на каждый запрос
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=config.LLM_POOL_SIZE)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def post(self, payload: dict, deadline_at: float = None, **kwargs) -> requests.Response:
+        """
+        POST в Ollama с ограниченным числом повторов при ошибках соединения и 5xx.
+        Таймаут каждой попытки и паузы между ними не выходят за deadline_at:
+        если бюджет исчерпан, вместо очередного повтора - DeadlineExceeded.
+        """
+        attempt = 0
+        while True:
+            timeout = self.timeout
+            remaining = remaining_time(deadline_at)
+            if remaining is not None:
+                timeout = (min(self.timeout[0], remaining), min(self.timeout[1], remaining))
+            try:
+                response = self.session.post(self.api_url, json=payload, timeout=timeout, **kwargs)
+                if response.status_code < 500 or attempt >= self.max_retries:
+                    return response
+                reason = f"HTTP {response.status_code}"
+                response.close()
+            except (requests.ConnectionError, requests.ConnectTimeout) as e:
+                if attempt >= self.max_retries:
+                    raise
+                reason = type(e).__name__
+
+            delay = retry_delay(attempt, deadline_at)
+            attempt += 1
+            metrics.inc("llm_retries_total")
+            print(f"🔁 Повтор запроса к LLM ({attempt}/{self.max_retries}) через {delay:.2f} сек: {reason}")
+            time.sleep(delay)
 
     def generate(self, prompt: str, system_prompt: str = "") -> str:
         """Вызов локальной модели через Ollama"""
+        return self.generate_with_stats(prompt, system_prompt)[0]
+
+    def generate_with_stats(self, prompt: str, system_prompt: str = "", **options) -> Tuple[str, Dict]:
+        """Ответ модели и статистика prefill/decode от Ollama"""
+
+        payload = build_payload(self.model, prompt, system_prompt, **options)
+
+        try:
+            start_time = time.time()
+            metrics.inc("llm_requests_total")
+            response = self.post(payload)
+            duration = time.time() - start_time
+
+            if response.status_code == 200:
+                result = response.json()
+                record_span("llm_request", duration, model=self.model)
+                return result.get("response", "").strip(), record_stats(result)
+            else:
+                metrics.inc("llm_errors_total")
+                print(f"❌ Ошибка LLM: {response.status_code}")
+                return f"Ошибка LLM: {response.status_code}", {}
+
+        except Exception as e:
+            metrics.inc("llm_errors_total")
+            return f"⚠️ Ошибка вызова LLM: {e}", {}
+
+    def generate_stream(self, prompt: str, system_prompt: str = "", deadline_at: float = None,
+                        context: List[int] = None, stats: Dict = None,
+                        **options) -> Generator[str, None, Optional[str]]:
+        """
+        Потоковый вызов Ollama: фрагменты ответа по мере генерации.
+        Генерация обрывается по deadline_at (time.monotonic()). Возвращаемое значение
+        генератора - причина обрыва: None, "deadline" или "error".
+        В переданный словарь stats записываются статистика prefill/decode и context диалога.
+        """
+
+        payload = build_payload(self.model, prompt, system_prompt, stream=True, context=context, **options)
+
+        try:
+            metrics.inc("llm_requests_total")
+            response = self.post(payload, deadline_at=deadline_at, stream=True)
+
+            if response.status_code != 200:
+                metrics.inc("llm_errors_total")
+                print(f"❌ Ошибка LLM: {response.status_code}")
+                response.close()
+                return "error"
+
+            with response:
+                for line in response.iter_lines():
+                    if not line:
+                        continue
+                    chunk = json.loads(line)
+                    if chunk.get("response"):
+                        yield chunk["response"]
+                    if chunk.get("done"):
+                        chunk_stats = record_stats(chunk)
+                        if stats is not None:
+                            stats.update(chunk_stats, context=chunk.get("context"))
+                        break
+                    if deadline_at is not None and time.monotonic() >= deadline_at:
+                        return "deadline"
 
-        full_prompt = f"{system_prompt.strip()}\n\n{prompt.strip()}"
+        except DeadlineExceeded:
+            return "deadline"
+        except requests.Timeout:
+            if deadline_at is not None and time.monotonic() >= deadline_at - 0.05:
+                return "deadline"
+            metrics.inc("llm_errors_total")
+            print("❌ Таймаут ожидания ответа LLM")
+            return "error"
+        except Exception as e:
+            metrics.inc("llm_errors_total")
+            print(f"⚠️ Ошибка вызова LLM: {e}")
+            return "error"
 
-        payload = {
-            "model": self.model,
-            "prompt": full_prompt,
-            "stream": False
-        }
+        return None
+
+    def is_available(self, timeout: float = None) -> Optional[bool]:
+        """Установлена ли модель в Ollama (/api/tags); None - Ollama не ответила"""
+        tags_url = self.api_url.rsplit("/api/", 1)[0] + "/api/tags"
+        try:
+            response = self.session.get(tags_url, timeout=timeout or self.timeout)
+            response.raise_for_status()
+            names = {model["name"] for model in response.json().get("models", [])}
+        except (requests.RequestException, ValueError, KeyError):
+            return None
+        return self.model in names or f"{self.model}:latest" in names
+
+    def warmup(self, system_prompt: str = "") -> Dict:
+        """Загрузка модели в память и prefill статического префикса до первого запроса"""
+        print(f"🔥 Прогрев LLM {self.model}...")
+        response, stats = self.generate_with_stats(".", system_prompt, num_predict=1)
+        if stats:
+            print(f"   ✅ LLM прогрета: префикс {stats['prompt_eval_count']} токенов "
+                  f"за {stats['prompt_eval_seconds']:.2f} сек, загрузка {stats['load_seconds']:.2f} сек")
+        return stats
+
+
+class AsyncLLMClient:
+    """Асинхронный клиент Ollama для AsyncRAGPipeline (httpx)"""
+
+    def __init__(self, model: str = "llama3"):
+        import httpx
+
+        self.model = model
+        self.api_url = config.LLM_API_URL
+        self.max_retries = config.LLM_MAX_RETRIES
+        self.client = httpx.AsyncClient(
+            timeout=httpx.Timeout(config.LLM_READ_TIMEOUT, connect=config.LLM_CONNECT_TIMEOUT),
+            limits=httpx.Limits(max_connections=config.LLM_POOL_SIZE,
+                                max_keepalive_connections=config.LLM_POOL_SIZE),
+        )
+
+    async def post(self, payload: dict, deadline_at: float = None):
+        """Как LLMClient.post: повторы при ошибках соединения и 5xx в пределах deadline_at"""
+        import httpx
+
+        attempt = 0
+        while True:
+            timeout = remaining_time(deadline_at)
+            try:
+                if timeout is None:
+                    response = await self.client.post(self.api_url, json=payload)
+                else:
+                    response = await self.client.post(
+                        self.api_url, json=payload,
+                        timeout=httpx.Timeout(min(config.LLM_READ_TIMEOUT, timeout),
+                                              connect=min(config.LLM_CONNECT_TIMEOUT, timeout))
+                    )
+                if response.status_code < 500 or attempt >= self.max_retries:
+                    return response
+                reason = f"HTTP {response.status_code}"
+            except (httpx.ConnectError, httpx.ConnectTimeout) as e:
+                if attempt >= self.max_retries:
+                    raise
+                reason = type(e).__name__
+
+            delay = retry_delay(attempt, deadline_at)
+            attempt += 1
+            metrics.inc("llm_retries_total")
+            print(f"🔁 Повтор запроса к LLM ({attempt}/{self.max_retries}) через {delay:.2f} сек: {reason}")
+            await asyncio.sleep(delay)
+
+    async def generate(self, prompt: str, system_prompt: str = "", deadline_at: float = None) -> str:
+        """Ответ модели; DeadlineExceeded, если бюджет deadline_at исчерпан, LLMError - при ошибке LLM"""
+        payload = build_payload(self.model, prompt, system_prompt)
 
         try:
             start_time = time.time()
-            response = requests.post(self.api_url, json=payload, timeout=900)
+            metrics.inc("llm_requests_total")
+            response = await self.post(payload, deadline_at=deadline_at)
             duration = time.time() - start_time
 
             if response.status_code == 200:
+                record_span("llm_request", duration, model=self.model)
                 result = response.json()
-                print(f"✅ Ответ получен от LLM за {duration:.2f} сек")
+                record_stats(result)
                 return result.get("response", "").strip()
             else:
+                metrics.inc("llm_errors_total")
                 print(f"❌ Ошибка LLM: {response.status_code}")
-                return f"Ошибка LLM: {response.status_code}"
+                raise LLMError(f"HTTP {response.status_code}")
 
+        except (DeadlineExceeded, LLMError):
+            raise
         except Exception as e:
-            return f"⚠️ Ошибка вызова LLM: {e}"
+            if deadline_at is not None and time.monotonic() >= deadline_at - 0.05:
+                raise DeadlineExceeded() from e  # таймаут попытки, урезанный до дедлайна
+            metrics.inc("llm_errors_total")
+            print(f"⚠️ Ошибка вызова LLM: {e}")
+            raise LLMError(str(e)) from e
+
+    async def aclose(self) -> None:
+        await self.client.aclose()
@@ -0,0 +1,282 @@
+#!/usr/bin/env python3
+"""
+Нагрузочный тест: набор вопросов проигрывается против RAGPipeline или HTTP API
+
+    python loadtest.py closed --concurrency 4                  - замкнутый цикл: N клиентов, следующий
+                                                                 запрос сразу после ответа
+    python loadtest.py open --qps 2                            - открытый цикл: запросы приходят с заданной
+                                                                 частотой (пуассоновский поток) независимо от ответов
+    python loadtest.py open --qps 2 --server http://host:8000  - то же против запущенного server.py
+
+Вопросы берутся из questions.txt или из журнала запросов (JSONL с полем question:
+вывод main.py --output или трассы TRACE_PATH). Отчет - JSON с отсортированными ключами,
+его можно сравнивать между запусками (--baseline прошлый_отчет.json).
+"""
+
+import argparse
+import json
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+
+from config import config
+from metrics import metrics, percentiles, split_name
+
+def load_queries(path: str) -> List[str]:
+    """Вопросы из текстового файла (по одному в строке) или из JSONL-журнала"""
+    with open(path, 'r', encoding='utf-8') as f:
+        lines = [line.strip() for line in f if line.strip()]
+    if not path.endswith(".jsonl"):
+        return lines
+
+    queries = []
+    for line in lines:
+        try:
+            record = json.loads(line)
+        except ValueError:
+            continue
+        question = record.get("question") or record.get("attributes", {}).get("question")
+        if question:
+            queries.append(question)
+    return queries
+
+def latency_summary(values: List[float]) -> Dict:
+    if not values:
+        return {}
+    summary = {f"p{int(q * 100)}": round(value, 4) for q, value in percentiles(values).items()}
+    summary.update(mean=round(sum(values) / len(values), 4), max=round(max(values), 4))
+    return summary
+
+class LoadTarget:
+    """answer_query и счетчики метрик: в процессе или через HTTP API"""
+
+    def __init__(self, server_url: str = None):
+        self.server_url = server_url
+        if server_url:
+            from rag_client import RAGServerClient
+            self.rag = RAGServerClient(server_url)
+        else:
+            from rag_pipeline import RAGPipeline
+            self.rag = RAGPipeline()
+            self.rag.load()
+
+    def answer(self, query: str, deadline: float = None) -> Dict:
+        return self.rag.answer_query(query, deadline=deadline)
+
+    def counters(self) -> Dict[str, float]:
+        snapshot = self.rag.health()["metrics"] if self.server_url else metrics.snapshot()
+        return {name: value for name, value in snapshot.items() if isinstance(value, (int, float))}
+
+class LoadTest:
+    def __init__(self, target: LoadTarget, queries: List[str], requests: int,
+                 duration: float = None, deadline: float = None):
+        self.target = target
+        self.queries = queries
+        self.requests = requests
+        self.duration = duration
+        self.deadline = deadline
+        self.results: List[Dict] = []
+        self.lock = threading.Lock()
+        self.started = None
+
+    def expired(self) -> bool:
+        return self.duration is not None and time.perf_counter() - self.started >= self.duration
+
+    def execute(self, index: int, scheduled: float) -> None:
+        """Один запрос; задержка считается от запланированного момента (с ожиданием в очереди)"""
+        query = self.queries[index % len(self.queries)]
+        started = time.perf_counter()
+        record = {"index": index, "question": query, "error": None, "degraded": None, "timings": {}}
+        try:
+            response = self.target.answer(query, self.deadline)
+            record.update(degraded=response.get("degraded"), timings=response.get("timings") or {})
+        except Exception as e:
+            record["error"] = f"{type(e).__name__}: {e}"
+        finished = time.perf_counter()
+        record.update(
+            start_s=round(scheduled - self.started, 4),
+            wait_s=round(started - scheduled, 4),
+            latency_s=round(finished - scheduled, 4)
+        )
+        with self.lock:
+            self.results.append(record)
+
+    def run_closed(self, concurrency: int) -> None:
+        """Замкнутый цикл: concurrency клиентов, каждый ждет ответа перед следующим запросом"""
+        counter = iter(range(self.requests))
+        counter_lock = threading.Lock()
+
+        def client():
+            while not self.expired():
+                with counter_lock:
+                    index = next(counter, None)
+                if index is None:
+                    return
+                self.execute(index, time.perf_counter())
+
+        self.started = time.perf_counter()
+        threads = [threading.Thread(target=client, name=f"load-{i}") for i in range(concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def run_open(self, qps: float, max_in_flight: int, seed: int) -> None:
+        """Открытый цикл: пуассоновский поток запросов с частотой qps, не зависящий от скорости ответов"""
+        rng = random.Random(seed)
+        self.started = time.perf_counter()
+        scheduled = self.started
+        with ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix="load") as executor:
+            for index in range(self.requests):
+                scheduled += rng.expovariate(qps)
+                delay = scheduled - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                if self.expired():
+                    break
+                executor.submit(self.execute, index, scheduled)
+
+    def summary(self, before: Dict[str, float], after: Dict[str, float]) -> Dict:
+        results = sorted(self.results, key=lambda record: record["index"])
+        ok = [record for record in results if record["error"] is None]
+        elapsed = max((record["start_s"] + record["latency_s"] for record in results), default=0.0)
+
+        stages: Dict[str, List[float]] = {}
+        for record in ok:
+            for stage, seconds in record["timings"].items():
+                stages.setdefault(stage, []).append(seconds)
+
+        degraded: Dict[str, int] = {}
+        for record in ok:
+            if record["degraded"]:
+                degraded[record["degraded"]] = degraded.get(record["degraded"], 0) + 1
+
+        delta = {name: after.get(name, 0) - before.get(name, 0) for name in after}
+        caches = {}
+        for name, lookups in delta.items():
+            base, labels = split_name(name)
+            if base == "cache_lookups_total" and lookups:
+                hits = delta.get(f"cache_hits_total{{{labels}}}", 0)
+                cache = labels.split('"')[1]
+                caches[cache] = {"hits": hits, "lookups": lookups, "hit_rate": round(hits / lookups, 4)}
+        paths = {split_name(name)[1].split('"')[1]: value for name, value in delta.items()
+                 if split_name(name)[0] == "answer_path_total" and value}
+
+        return {
+            "requests": len(results),
+            "errors": len(results) - len(ok),
+            "error_rate": round((len(results) - len(ok)) / len(results), 4) if results else 0.0,
+            "degraded": degraded,
+            "duration_s": round(elapsed, 3),
+            "throughput_qps": round(len(ok) / elapsed, 3) if elapsed else 0.0,
+            "latency_s": latency_summary([record["latency_s"] for record in ok]),
+            "wait_s": latency_summary([record["wait_s"] for record in ok]),
+            "stages_s": {stage: latency_summary(values) for stage, values in stages.items()},
+            "caches": caches,
+            "answer_paths": paths,
+            "llm_requests": delta.get("llm_requests_total", 0),
+            "llm_retries": delta.get("llm_retries_total", 0)
+        }
+
+def print_summary(summary: Dict) -> None:
+    print("\n" + "=" * 80)
+    print("📈 РЕЗУЛЬТАТЫ НАГРУЗОЧНОГО ТЕСТА")
+    print("=" * 80)
+    print(f"Запросов: {summary['requests']}, ошибок: {summary['errors']} ({summary['error_rate']:.1%}), "
+          f"деградаций: {sum(summary['degraded'].values())}")
+    print(f"Пропускная способность: {summary['throughput_qps']} запросов/сек за {summary['duration_s']} сек")
+    latency = summary["latency_s"]
+    if latency:
+        print(f"Задержка: p50 {latency['p50']:.3f} | p95 {latency['p95']:.3f} | p99 {latency['p99']:.3f} | "
+              f"max {latency['max']:.3f} сек (ожидание в очереди p95 {summary['wait_s']['p95']:.3f})")
+    print("\nЭтапы (сек):       p50       p95       p99")
+    for stage, values in sorted(summary["stages_s"].items()):
+        print(f"   {stage:<14} {values['p50']:>8.4f}  {values['p95']:>8.4f}  {values['p99']:>8.4f}")
+    for cache, stats in sorted(summary["caches"].items()):
+        print(f"🗃️ Кэш {cache}: {stats['hit_rate']:.1%} попаданий ({stats['hits']:.0f}/{stats['lookups']:.0f})")
+    if summary["answer_paths"]:
+        print("🛤️ Пути ответа: " + ", ".join(f"{path} {count:.0f}" for path, count in sorted(summary["answer_paths"].items())))
+
+def print_comparison(baseline: Dict, summary: Dict) -> None:
+    """Ключевые показатели относительно прошлого отчета"""
+    rows = [("throughput_qps", baseline.get("throughput_qps"), summary["throughput_qps"]),
+            ("error_rate", baseline.get("error_rate"), summary["error_rate"])]
+    for key in ("p50", "p95", "p99"):
+        rows.append((f"latency {key}", baseline.get("latency_s", {}).get(key), summary["latency_s"].get(key)))
+    for stage, values in sorted(summary["stages_s"].items()):
+        rows.append((f"{stage} p95", baseline.get("stages_s", {}).get(stage, {}).get("p95"), values.get("p95")))
+
+    print("\n" + "=" * 80)
+    print("🔁 СРАВНЕНИЕ С ПРОШЛЫМ ЗАПУСКОМ")
+    print("=" * 80)
+    for name, old, new in rows:
+        if old is None or new is None:
+            continue
+        change = f"{(new - old) / old:+.1%}" if old else "-"
+        print(f"   {name:<22} {old:>10.4f} → {new:>10.4f}  {change}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный тест RAG пайплайна")
+    parser.add_argument("mode", choices=["closed", "open"], help="Замкнутый (concurrency) или открытый (qps) цикл")
+    parser.add_argument("--questions", default="questions.txt", help="Вопросы: .txt по одному в строке или JSONL-журнал")
+    parser.add_argument("--requests", type=int, default=None, help="Всего запросов (по умолчанию - по одному на вопрос)")
+    parser.add_argument("--duration", type=float, default=None, help="Остановить подачу запросов через N сек")
+    parser.add_argument("--concurrency", type=int, default=config.BATCH_LLM_PARALLELISM, help="closed: число клиентов")
+    parser.add_argument("--qps", type=float, default=1.0, help="open: средняя частота запросов")
+    parser.add_argument("--max-in-flight", type=int, default=64, help="open: максимум одновременных запросов")
+    parser.add_argument("--seed", type=int, default=0, help="open: зерно генератора интервалов")
+    parser.add_argument("--deadline", type=float, default=None, help="Лимит времени на один вопрос, сек")
+    parser.add_argument("--server", type=str, help="URL запущенного HTTP API вместо RAGPipeline в процессе")
+    parser.add_argument("--output", help="JSON-файл для отчета")
+    parser.add_argument("--baseline", help="Отчет прошлого запуска для сравнения")
+    args = parser.parse_args()
+
+    queries = load_queries(args.questions)
+    if not queries:
+        print(f"❌ В {args.questions} нет вопросов")
+        return
+    requests = args.requests or len(queries)
+
+    target = LoadTarget(args.server)
+    test = LoadTest(target, queries, requests, args.duration, args.deadline)
+    load = f"{args.concurrency} клиентов" if args.mode == "closed" else f"{args.qps} запросов/сек"
+    print(f"🚀 Нагрузка: {args.mode}, {load}, {requests} запросов, цель: {args.server or 'RAGPipeline'}")
+
+    before = target.counters()
+    if args.mode == "closed":
+        test.run_closed(args.concurrency)
+    else:
+        test.run_open(args.qps, args.max_in_flight, args.seed)
+    summary = test.summary(before, target.counters())
+
+    print_summary(summary)
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            print_comparison(json.load(f)["summary"], summary)
+
+    if args.output:
+        report = {
+            "settings": {
+                "mode": args.mode,
+                "target": args.server or "in-process",
+                "concurrency": args.concurrency if args.mode == "closed" else None,
+                "qps": args.qps if args.mode == "open" else None,
+                "seed": args.seed if args.mode == "open" else None,
+                "requests": requests,
+                "duration": args.duration,
+                "deadline": args.deadline,
+                "questions": args.questions,
+                "llm_model": config.LLM_MODEL,
+                "embedding_model": config.EMBEDDING_MODEL
+            },
+            "summary": summary,
+            "requests": sorted(test.results, key=lambda record: record["index"])
+        }
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2, sort_keys=True)
+        print(f"\n💾 Отчет сохранен в: {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -4,31 +4,89 @@
 """
 
 import argparse
+import json
+import os
 import sys
-from rag_pipeline import RAGPipeline
 from tqdm import tqdm  # Прогресс-бар для пакетной обработки
 
+from profiler import add_profile_argument, checkpoint, profiling
+from startup_profile import lazy_import, startup
+
 def parse_args():
     parser = argparse.ArgumentParser(description="RAG-бот с локальной LLM")
     parser.add_argument("--debug", action="store_true", help="Включить режим отладки (печать промптов и чанков)")
     parser.add_argument("--no-protection", action="store_true", help="Отключить фильтрацию вредоносных чанков")
     parser.add_argument("--query", type=str, help="Задать один вопрос при запуске")
     parser.add_argument("--file", type=str, help="Файл с вопросами (по одному в строке)")
+    parser.add_argument("--parallel", type=int, default=None, help="Параллельных запросов к LLM в пакетном режиме")
+    parser.add_argument("--serve", action="store_true", help="Запустить HTTP API с однократно загруженными моделями")
+    parser.add_argument("--host", type=str, default=None, help="Адрес HTTP API для --serve")
+    parser.add_argument("--port", type=int, default=None, help="Порт HTTP API для --serve")
+    parser.add_argument("--workers", type=int, default=1, help="Число prefork-воркеров для --serve (общая память модели)")
+    parser.add_argument("--server", type=str, help="URL запущенного HTTP API (режим тонкого клиента)")
+    parser.add_argument("--deadline", type=float, default=None, help="Лимит времени на один вопрос, сек")
+    parser.add_argument("--startup-profile", action="store_true", help="Показать время импорта и инициализации")
+    parser.add_argument("--output", type=str, help="JSONL-файл для ответов пакетного режима (с продолжением после сбоя)")
+    add_profile_argument(parser)
     return parser.parse_args()
 
-def process_batch_file(rag: RAGPipeline, file_path: str):
+def load_answered(output_path: str) -> set:
+    """Ключи (номер, вопрос) уже записанных ответов; оборванная последняя строка отрезается"""
+    answered = set()
+    if not output_path or not os.path.exists(output_path):
+        return answered
+
+    with open(output_path, 'rb+') as f:
+        data = f.read()
+        complete = data.rfind(b"\n") + 1
+        if complete < len(data):
+            f.truncate(complete)
+            print(f"⚠️ Отброшена незавершенная запись в конце {output_path}")
+
+    for line in data[:complete].decode('utf-8').splitlines():
+        try:
+            record = json.loads(line)
+            answered.add((record["index"], record["question"]))
+        except (ValueError, KeyError):
+            continue
+    return answered
+
+def process_batch_file(rag, file_path: str, parallelism: int = None, output_path: str = None,
+                       deadline: float = None):
     try:
         with open(file_path, 'r', encoding='utf-8') as f:
             questions = [line.strip() for line in f if line.strip()]
 
+        answered = load_answered(output_path)
+        todo = [(idx, q) for idx, q in enumerate(questions, 1) if (idx, q) not in answered]
+
         print(f"\n📄 Обработка {len(questions)} вопросов из файла: {file_path}\n")
+        if answered:
+            print(f"⏭️ Пропущено уже отвеченных: {len(questions) - len(todo)}")
 
-        for idx, question in enumerate(tqdm(questions, desc="📊 Прогресс", unit="вопрос"), 1):
-            print(f"\n📌 Вопрос {idx}: {question}")
-            response = rag.process_query(question)
-            print("🤖 Ответ:")
-            print(response)
-            print("------------------------------------------------------------")
+        output = open(output_path, 'a', encoding='utf-8') if output_path else None
+        try:
+            # process_queries отдает записи по мере готовности: каждая сразу попадает на диск,
+            # и после сбоя повторный запуск продолжит с первого неотвеченного вопроса
+            records = rag.process_queries([q for _, q in todo], parallelism=parallelism, deadline=deadline)
+            progress = tqdm(zip(todo, records), total=len(todo), desc="📊 Прогресс", unit="вопрос")
+            for (idx, question), record in progress:
+                # Диагностика этапов собрана отдельно для каждого вопроса (параллельные потоки)
+                log = record.pop("log", "")
+                print(f"\n📌 Вопрос {idx}: {question}")
+                if rag.debug and log:
+                    print("\n".join(f"   [{idx}] {line}" for line in log.splitlines() if line.strip()))
+                print("🤖 Ответ:")
+                print(record["answer"])
+                print("------------------------------------------------------------")
+
+                if output:
+                    output.write(json.dumps({"index": idx, **record}, ensure_ascii=False) + "\n")
+                    output.flush()
+                    os.fsync(output.fileno())
+        finally:
+            if output:
+                output.close()
 
     except FileNotFoundError:
         print(f"❌ Файл не найден: {file_path}")
@@ -37,21 +95,51 @@ def process_batch_file(rag: RAGPipeline, file_path: str):
 
 def main():
     args = parse_args()
-
-    rag = RAGPipeline()
+    try:
+        with profiling(args.profile, "main"):
+            run(args)
+    finally:
+        if args.startup_profile:
+            startup.report()
+
+def run(args):
+    # Тонкий клиент не загружает модели: все делает уже запущенный сервер
+    if args.server:
+        RAGServerClient = lazy_import("rag_client").RAGServerClient
+        rag = RAGServerClient(args.server)
+    else:
+        RAGPipeline = lazy_import("rag_pipeline").RAGPipeline
+        with startup.measure("init", "RAGPipeline()"):
+            rag = RAGPipeline()
+        checkpoint("RAGPipeline()")
 
     rag.debug = args.debug
     rag.protection_enabled = not args.no_protection
 
+    if args.serve:
+        if args.workers > 1:
+            PreforkServer = lazy_import("prefork").PreforkServer
+            PreforkServer(rag, args.workers, args.host, args.port).serve()
+        else:
+            serve = lazy_import("server").serve
+            serve(rag, args.host, args.port)
+        return
+
     # Если передан файл с вопросами
     if args.file:
-        process_batch_file(rag, args.file)
+        process_batch_file(rag, args.file, args.parallel, args.output, args.deadline)
         return
 
     # Если передан одиночный вопрос
     if args.query:
         print("\n🎯 Вопрос:", args.query)
-        response = rag.process_query(args.query)
+        if args.server:
+            print("\n🤖 Ответ:")
+            for part in rag.stream_query(args.query, deadline=args.deadline):
+                print(part, end="", flush=True)
+            print()
+            return
+        response = rag.process_query(args.query, deadline=args.deadline)
         print("\n🤖 Ответ:")
         print(response)
         return
@@ -60,7 +148,7 @@ def main():
     print("\n============================================================")
     print("🤖 Локальный RAG БОТ (LLM + векторный поиск)")
     print("============================================================")
-    print("Для выхода: 'quit', 'exit' или Ctrl+C")
+    print("Для выхода: 'quit', 'exit' или Ctrl+C; новый диалог: 'reset'")
     print("------------------------------------------------------------")
 
     while True:
@@ -69,8 +157,17 @@ def main():
             if query.lower() in ["quit", "exit"]:
                 print("👋 До встречи!")
                 break
-
-            response = rag.process_query(query)
+            if query.lower() == "reset":
+                if not args.server:
+                    rag.sessions.drop("default")
+                print("🆕 Начат новый диалог")
+                continue
+
+            # Локально ходы диалога продолжают одну сессию Ollama (без повторной отправки контекста)
+            if args.server:
+                response = rag.process_query(query, deadline=args.deadline)
+            else:
+                response = rag.chat(query, deadline=args.deadline)
             print("\n============================================================")
             print("🤖 ОТВЕТ:")
             print(response.strip())
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+Простые потокобезопасные метрики RAG-бота
+"""
+
+import bisect
+import re
+import threading
+from collections import deque
+from typing import Dict, List, Sequence, Tuple
+
+DEFAULT_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128)
+QUANTILES = (0.5, 0.95, 0.99)
+RESERVOIR_SIZE = 1024  # последних наблюдений для перцентилей
+
+def split_name(name: str) -> Tuple[str, str]:
+    """'a_total{reason="x"}' -> ('a_total', 'reason="x"')"""
+    match = re.match(r"^([^{]+)(?:\{(.*)\})?$", name)
+    return match.group(1), match.group(2) or ""
+
+def with_labels(base: str, labels: str, extra: str = "") -> str:
+    merged = ",".join(part for part in (labels, extra) if part)
+    return f"{base}{{{merged}}}" if merged else base
+
+def percentiles(values: Sequence[float], quantiles: Sequence[float] = QUANTILES) -> Dict[float, float]:
+    """Перцентили по ближайшему рангу; пустой словарь для пустой выборки"""
+    values = sorted(values)
+    if not values:
+        return {}
+    return {q: values[min(len(values) - 1, int(q * len(values)))] for q in quantiles}
+
+
+class Histogram:
+    def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.buckets: List[float] = sorted(buckets)
+        self.counts: List[int] = [0] * (len(self.buckets) + 1)  # последний - "+Inf"
+        self.count = 0
+        self.sum = 0.0
+        self.recent = deque(maxlen=RESERVOIR_SIZE)
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.recent.append(value)
+
+    def quantiles(self) -> Dict[float, float]:
+        """p50/p95/p99 по последним RESERVOIR_SIZE наблюдениям"""
+        return percentiles(self.recent)
+
+    def to_dict(self) -> Dict:
+        labels = [str(b) for b in self.buckets] + ["+Inf"]
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "buckets": dict(zip(labels, self.counts)),
+            **{f"p{int(q * 100)}": value for q, value in self.quantiles().items()}
+        }
+
+
+class Metrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters: Dict[str, float] = {}
+        self.histograms: Dict[str, Histogram] = {}
+
+    def inc(self, name: str, value: float = 1) -> None:
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def get(self, name: str) -> float:
+        with self._lock:
+            return self.counters.get(name, 0)
+
+    def observe(self, name: str, value: float, buckets: Sequence[float] = DEFAULT_BUCKETS) -> None:
+        with self._lock:
+            if name not in self.histograms:
+                self.histograms[name] = Histogram(buckets)
+            self.histograms[name].observe(value)
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            snapshot = dict(self.counters)
+            for name, histogram in self.histograms.items():
+                snapshot[name] = histogram.to_dict()
+            return snapshot
+
+    def prometheus(self, prefix: str = "rag_") -> str:
+        """Текстовый формат Prometheus: счетчики, гистограммы и перцентили (..._quantile)"""
+        lines = []
+        typed = set()
+
+        def declare(name: str, kind: str) -> None:
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {name} {kind}")
+
+        with self._lock:
+            for name, value in sorted(self.counters.items()):
+                base, labels = split_name(name)
+                declare(prefix + base, "counter")
+                lines.append(f"{with_labels(prefix + base, labels)} {value}")
+
+            # Строки одного семейства метрик должны идти подряд: сначала гистограммы, затем перцентили
+            histograms = sorted((split_name(name), histogram) for name, histogram in self.histograms.items())
+            for (base, labels), histogram in histograms:
+                metric = prefix + base
+                declare(metric, "histogram")
+                cumulative = 0
+                for bound, count in zip([str(b) for b in histogram.buckets] + ["+Inf"], histogram.counts):
+                    cumulative += count
+                    bucket = with_labels(metric + "_bucket", labels, 'le="%s"' % bound)
+                    lines.append(f"{bucket} {cumulative}")
+                lines.append(f"{with_labels(metric + '_sum', labels)} {histogram.sum}")
+                lines.append(f"{with_labels(metric + '_count', labels)} {histogram.count}")
+
+            for (base, labels), histogram in histograms:
+                metric = prefix + base + "_quantile"
+                declare(metric, "gauge")
+                for q, value in histogram.quantiles().items():
+                    quantile = with_labels(metric, labels, 'quantile="%s"' % q)
+                    lines.append(f"{quantile} {value}")
+        return "\n".join(lines) + "\n"
+
+    def reset(self) -> None:
+        with self._lock:
+            self.counters.clear()
+            self.histograms.clear()
+
+
+# Общий экземпляр метрик процесса
+metrics = Metrics()
@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+"""
+Prefork-режим HTTP API: модели загружаются в родителе один раз,
+воркеры получают их страницы через fork() по copy-on-write (только Linux/Unix)
+
+Chroma (SQLite и HNSW-индекс) открывается в каждом воркере после fork():
+соединения SQLite и потоки Chroma не переживают fork().
+Метрики (/metrics, /health) у каждого воркера свои: запрос попадает в случайный
+воркер, поэтому для суммарной картины нужно опрашивать воркеры по отдельности
+или считать их одним job с разными instance и суммировать в Prometheus.
+"""
+
+import os
+import signal
+import sys
+import time
+import traceback
+from collections import deque
+from typing import Dict
+
+from config import config
+from server import create_server
+from startup_profile import lazy_import
+
+def read_memory(pid: int) -> Dict[str, int]:
+    """RSS, PSS и уникальная память (USS = Private_Clean + Private_Dirty) процесса, КБ"""
+    fields = {}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) >= 2 and parts[0].endswith(":") and parts[1].isdigit():
+                    fields[parts[0][:-1]] = int(parts[1])
+    except OSError:
+        return {}
+
+    return {
+        "rss": fields.get("Rss", 0),
+        "pss": fields.get("Pss", 0),
+        "uss": fields.get("Private_Clean", 0) + fields.get("Private_Dirty", 0)
+    }
+
+class PreforkServer:
+    def __init__(self, rag, workers: int = None, host: str = None, port: int = None):
+        self.rag = rag
+        self.workers_count = workers or config.PREFORK_WORKERS
+        self.host = host
+        self.port = port
+        self.workers: Dict[int, int] = {}  # pid -> номер воркера
+        self.stopping = False
+        self.failed = False
+        self.restarts = deque()  # время перезапусков воркеров за последнее окно
+        self.server = None
+
+    def warmup(self) -> None:
+        """
+        Загрузка моделей в память родителя до fork(). Векторная БД открывается
+        для проверки и закрывается: воркеры подключаются к ней сами
+        """
+        if config.EMBEDDING_BACKEND == "sentence_transformers":
+            # Пул потоков OpenMP не переживает fork(): в родителе torch работает в один поток
+            lazy_import("torch").set_num_threads(1)
+        self.rag.load(open_index=False)
+        self.rag.embed_model.encode(["прогрев"])
+        self.rag.collection
+        self.rag.close_index()
+
+    def spawn(self, number: int) -> None:
+        pid = os.fork()
+        if pid:
+            self.workers[pid] = number
+            return
+
+        # Дочерний процесс: свои потоки и соединения, общие страницы моделей.
+        # Исключение не должно выйти за пределы spawn(): иначе воркер продолжит код родителя
+        code = 0
+        try:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            torch = sys.modules.get("torch")
+            if torch is not None:
+                torch.set_num_threads(config.PREFORK_TORCH_THREADS)
+            self.rag.after_fork()
+            self.rag.collection
+            self.server.serve_forever()
+        except BaseException:
+            print(f"❌ Воркер {number} (pid={os.getpid()}) завершился с ошибкой:")
+            traceback.print_exc()
+            code = 1
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os._exit(code)
+
+    def allow_restart(self) -> bool:
+        """Не больше PREFORK_MAX_RESTARTS перезапусков за PREFORK_RESTART_WINDOW_S секунд"""
+        now = time.monotonic()
+        while self.restarts and now - self.restarts[0] > config.PREFORK_RESTART_WINDOW_S:
+            self.restarts.popleft()
+        if len(self.restarts) >= config.PREFORK_MAX_RESTARTS:
+            return False
+        self.restarts.append(now)
+        return True
+
+    def memory_report(self) -> None:
+        parent = read_memory(os.getpid())
+        if not parent:
+            print("⚠️ /proc/<pid>/smaps_rollup недоступен, отчет по памяти пропущен")
+            return
+
+        print("\n📊 Память prefork-сервера (МБ):")
+        print(f"   родитель  pid={os.getpid():<7} RSS={parent['rss'] / 1024:8.1f}  USS={parent['uss'] / 1024:8.1f}")
+        total = parent["uss"]
+        for pid, number in sorted(self.workers.items(), key=lambda item: item[1]):
+            worker = read_memory(pid)
+            if not worker:
+                continue
+            total += worker["uss"]
+            print(f"   воркер {number:<2} pid={pid:<7} RSS={worker['rss'] / 1024:8.1f}  USS={worker['uss'] / 1024:8.1f}")
+
+        # N независимых процессов держали бы каждый свою копию модели и индекса
+        independent = parent["rss"] * len(self.workers)
+        print(f"   Итого уникальной памяти: {total / 1024:.1f} МБ "
+              f"против ~{independent / 1024:.1f} МБ у {len(self.workers)} независимых процессов "
+              f"(экономия ~{(independent - total) / 1024:.1f} МБ)")
+
+    def stop(self, signum=None, frame=None) -> None:
+        self.stopping = True
+        for pid in list(self.workers):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def serve(self) -> None:
+        print(f"🔥 Предзагрузка моделей перед запуском {self.workers_count} воркеров...")
+        try:
+            self.warmup()
+        except Exception as e:
+            print(f"❌ Ошибка подготовки к запуску воркеров: {e}")
+            sys.exit(1)
+
+        # Сокет открывается в родителе и наследуется всеми воркерами
+        self.server = create_server(self.rag, self.host, self.port)
+        host, port = self.server.server_address[:2]
+        print(f"🌐 Prefork RAG API: http://{host}:{port} ({self.workers_count} воркеров, Ctrl+C для остановки)")
+
+        for number in range(1, self.workers_count + 1):
+            self.spawn(number)
+
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+
+        next_report = time.monotonic() + config.PREFORK_REPORT_DELAY
+        while self.workers:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                break
+
+            if pid and pid in self.workers:
+                number = self.workers.pop(pid)
+                if self.stopping:
+                    continue
+                if not self.allow_restart():
+                    print(f"❌ Воркеры падают слишком часто (больше {config.PREFORK_MAX_RESTARTS} за "
+                          f"{config.PREFORK_RESTART_WINDOW_S} сек), сервер останавливается")
+                    self.failed = True
+                    self.stop()
+                    continue
+                print(f"⚠️ Воркер {number} (pid={pid}) завершился с кодом {status}, "
+                      f"перезапуск через {config.PREFORK_RESTART_DELAY_S} сек")
+                time.sleep(config.PREFORK_RESTART_DELAY_S)
+                if not self.stopping:
+                    self.spawn(number)
+                continue
+
+            if not self.stopping and time.monotonic() >= next_report:
+                self.memory_report()
+                next_report = time.monotonic() + config.PREFORK_REPORT_INTERVAL
+            time.sleep(0.5)
+
+        self.server.server_close()
+        print("\n👋 Сервер остановлен")
+        if self.failed:
+            sys.exit(1)
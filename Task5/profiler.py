@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+"""
+Профилирование по требованию (--profile cpu|mem):
+
+    cpu - сэмплирующий профайлер: стеки всех потоков раз в PROFILE_SAMPLE_INTERVAL_MS,
+          результат в формате collapsed stacks (flamegraph.pl, speedscope, inferno)
+    mem - tracemalloc: разница снимков памяти по этапам (спаны tracing и
+          контрольные точки checkpoint), топ строк по приросту
+
+Результаты пишутся в каталог PROFILE_DIR/<имя>_<время>.
+Программно: with profiling("cpu", "query"): rag.process_query(...) или profile_query().
+"""
+
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from config import config
+
+MODES = ("cpu", "mem")
+
+_active: Optional["Profiler"] = None
+
+def frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+class SamplingProfiler:
+    """Стеки всех потоков, кроме собственного, с фиксированным интервалом"""
+
+    def __init__(self, interval: float = None):
+        self.interval = interval or config.PROFILE_SAMPLE_INTERVAL_MS / 1000
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="rag-profiler", daemon=True)
+
+    def _run(self) -> None:
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(frame_label(frame))
+                    frame = frame.f_back
+                stack.append(names.get(thread_id, str(thread_id)))
+                self.stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def collapsed(self) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in sorted(self.stacks.items()))
+
+    def top_functions(self, limit: int = 15) -> List[Tuple[str, int]]:
+        """Функции по числу сэмплов, в которых они были на вершине стека (self time)"""
+        leaves: Counter = Counter()
+        for stack, count in self.stacks.items():
+            leaves[stack.rsplit(";", 1)[-1]] += count
+        return leaves.most_common(limit)
+
+class MemoryProfiler:
+    """Разница снимков tracemalloc по этапам"""
+
+    FILTERS = (
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+        tracemalloc.Filter(False, "<unknown>"),
+    )
+
+    def __init__(self, top: int = None):
+        self.top = top or config.PROFILE_MEM_TOP
+        self.stages: List[Dict] = []
+        self.lock = threading.Lock()
+        self.last_snapshot = None
+        self.last_checkpoint = "старт"
+
+    def snapshot(self):
+        return tracemalloc.take_snapshot().filter_traces(self.FILTERS)
+
+    def start(self) -> None:
+        tracemalloc.start(config.PROFILE_TRACEMALLOC_FRAMES)
+        self.last_snapshot = self.snapshot()
+
+    def stop(self) -> None:
+        self.checkpoint("конец")
+        self.peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    def record(self, name: str, before, after) -> None:
+        diff = after.compare_to(before, "lineno")
+        current, peak = tracemalloc.get_traced_memory()
+        with self.lock:
+            self.stages.append({
+                "name": name,
+                "size_diff": sum(stat.size_diff for stat in diff),
+                "current": current,
+                "peak": peak,
+                "top": [stat for stat in diff if stat.size_diff][:self.top]
+            })
+
+    def checkpoint(self, name: str) -> None:
+        """Этап от предыдущей контрольной точки до текущего момента"""
+        after = self.snapshot()
+        self.record(f"{self.last_checkpoint} → {name}", self.last_snapshot, after)
+        self.last_snapshot, self.last_checkpoint = after, name
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        """Этап-блок; при параллельных запросах в разницу попадают и соседние потоки"""
+        before = self.snapshot()
+        try:
+            yield
+        finally:
+            self.record(name, before, self.snapshot())
+
+    def report(self) -> str:
+        lines = []
+        for stage in self.stages:
+            lines.append(f"=== {stage['name']}: {stage['size_diff'] / 1024:+.1f} КБ "
+                         f"(занято {stage['current'] / 1024 / 1024:.1f} МБ, пик {stage['peak'] / 1024 / 1024:.1f} МБ)")
+            lines.extend(f"    {stat}" for stat in stage["top"])
+        return "\n".join(lines) + "\n"
+
+class Profiler:
+    def __init__(self, mode: str, name: str = "run", output_dir: str = None):
+        if mode not in MODES:
+            raise ValueError(f"Неизвестный режим профилирования: {mode} (ожидается {', '.join(MODES)})")
+        self.mode = mode
+        self.name = name
+        self.output_dir = output_dir or self.make_output_dir(name)
+        self.cpu = SamplingProfiler() if mode == "cpu" else None
+        self.memory = MemoryProfiler() if mode == "mem" else None
+        self.started = None
+
+    @staticmethod
+    def make_output_dir(name: str) -> str:
+        base = os.path.join(config.PROFILE_DIR, f"{name}_{time.strftime('%Y%m%d_%H%M%S')}")
+        path, suffix = base, 1
+        while os.path.exists(path):
+            suffix += 1
+            path = f"{base}_{suffix}"
+        return path
+
+    def start(self) -> None:
+        self.started = time.perf_counter()
+        if self.cpu:
+            self.cpu.start()
+        if self.memory:
+            self.memory.start()
+
+    def stop(self) -> None:
+        duration = time.perf_counter() - self.started
+        os.makedirs(self.output_dir, exist_ok=True)
+
+        print("\n" + "=" * 60)
+        print(f"🔬 ПРОФИЛЬ ({self.mode}): {self.name}, {duration:.2f} сек")
+        print("=" * 60)
+        if self.cpu:
+            self.cpu.stop()
+            path = os.path.join(self.output_dir, "cpu.collapsed")
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(self.cpu.collapsed())
+            print(f"Сэмплов: {self.cpu.samples} (интервал {self.cpu.interval * 1000:.0f} мс)")
+            for label, count in self.cpu.top_functions(10):
+                print(f"   {count:6d}  {label}")
+            print(f"💾 Стеки для flamegraph: {path}")
+        if self.memory:
+            self.memory.stop()
+            path = os.path.join(self.output_dir, "memory.txt")
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(self.memory.report())
+            for stage in self.memory.stages:
+                print(f"   {stage['size_diff'] / 1024:+10.1f} КБ  {stage['name']}")
+            print(f"Пик: {self.memory.peak / 1024 / 1024:.1f} МБ")
+            print(f"💾 Разница снимков по этапам: {path}")
+        print("=" * 60)
+
+@contextmanager
+def profiling(mode: Optional[str], name: str = "run", output_dir: str = None) -> Iterator[Optional[Profiler]]:
+    """Профилирование блока; mode=None - без профилирования"""
+    global _active
+    if mode is None:
+        yield None
+        return
+    if _active is not None:  # вложенный вызов: профиль уже собирается
+        yield _active
+        return
+
+    profiler = Profiler(mode, name, output_dir)
+    profiler.start()
+    _active = profiler
+    try:
+        yield profiler
+    finally:
+        _active = None
+        profiler.stop()
+
+def stage(name: str):
+    """Этап для профиля памяти (no-op, если профиль памяти не собирается)"""
+    profiler = _active
+    if profiler is None or profiler.memory is None:
+        return nullcontext()
+    return profiler.memory.stage(name)
+
+def checkpoint(name: str) -> None:
+    """Контрольная точка профиля памяти: разница с предыдущей точкой"""
+    profiler = _active
+    if profiler is not None and profiler.memory is not None:
+        profiler.memory.checkpoint(name)
+
+def profile_query(rag, query: str, mode: str = "cpu", deadline: float = None,
+                  output_dir: str = None) -> Tuple[str, str]:
+    """Ответ RAGPipeline.process_query под профайлером и каталог с результатами"""
+    with profiling(mode, "query", output_dir) as profiler:
+        answer = rag.process_query(query, deadline=deadline)
+    return answer, profiler.output_dir
+
+def add_profile_argument(parser) -> None:
+    parser.add_argument("--profile", choices=MODES, default=None,
+                        help=f"Профилировать запуск: cpu (flamegraph) или mem (tracemalloc), результат в {config.PROFILE_DIR}/")
@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+"""
+Тонкий клиент HTTP API RAG-бота (только стандартная библиотека)
+"""
+
+import json
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterator, List
+
+from config import config
+
+class RAGServerClient:
+    """Тот же интерфейс, что у RAGPipeline, но запросы уходят на server.py"""
+
+    def __init__(self, base_url: str, timeout: float = None):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout or config.LLM_READ_TIMEOUT
+        self.debug = False
+        self.protection_enabled = True  # Защита настраивается на стороне сервера
+
+    def request(self, path: str, payload: dict = None):
+        data = json.dumps(payload, ensure_ascii=False).encode("utf-8") if payload is not None else None
+        req = urllib.request.Request(
+            self.base_url + path,
+            data=data,
+            headers={"Content-Type": "application/json"}
+        )
+        return urllib.request.urlopen(req, timeout=self.timeout)
+
+    def health(self) -> Dict:
+        with self.request("/health") as response:
+            return json.load(response)
+
+    def answer_query(self, query: str, deadline: float = None) -> Dict:
+        with self.request("/query", {"query": query, "deadline": deadline}) as response:
+            return json.load(response)
+
+    def process_query(self, query: str, deadline: float = None) -> str:
+        return self.answer_query(query, deadline)["answer"]
+
+    def stream_query(self, query: str, deadline: float = None) -> Iterator[str]:
+        with self.request("/query/stream", {"query": query, "deadline": deadline}) as response:
+            for line in response:
+                chunk = json.loads(line)
+                if chunk.get("error"):
+                    raise RuntimeError(chunk["error"])
+                if chunk.get("response"):
+                    yield chunk["response"]
+                if chunk.get("done"):
+                    break
+
+    def process_queries(self, queries: List[str], parallelism: int = None, deadline: float = None) -> Iterator[Dict]:
+        parallelism = parallelism or config.BATCH_LLM_PARALLELISM
+        with ThreadPoolExecutor(max_workers=parallelism) as executor:
+            yield from executor.map(lambda query: self.answer_query(query, deadline), queries)
@@ -3,137 +3,850 @@
 RAG пайплайн с локальной LLM через Ollama
 """
 
-import chromadb
-from sentence_transformers import SentenceTransformer
-from typing import List, Dict
+import io
+import json
+import os
+import sys
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Generator, Iterator, Optional, Tuple
 import time
 
 from config import config
-from prompts import build_rag_prompt, get_response_template
+from prompts import build_followup_prompt, build_system_prompt, build_user_prompt, get_response_template
 from llm_client import LLMClient
+from context_packer import count_tokens, pack_context, split_header
+from extractive import entity_coverage, extract_answer, parse_simple_question, stems
+from injection_scanner import get_scanner
+from metrics import metrics
+from router import is_unknown, large_route, route_query
+from session import SessionStore
+from startup_profile import lazy_import, startup
+from tracing import annotate, record_span, span, trace
+
+TOKEN_BUCKETS = (128, 256, 512, 768, 1024, 1536, 2048, 4096)
+TOP_K_BUCKETS = (1, 2, 3, 4, 5, 7, 10)
+RESULT_KEYS = ("ids", "documents", "metadatas", "distances", "embeddings")  # поля выдачи Chroma по чанкам
+
+PARTIAL_SUFFIXES = {
+    "deadline": "\n\n⏱️ [Ответ прерван: превышен лимит времени на запрос]",
+    "error": "\n\n⚠️ [Ответ прерван: ошибка LLM]"
+}
+
+_captured = threading.local()
+
+class CapturingStdout:
+    """sys.stdout: вывод потоков с перехватом (captured_output) идет в их буфер, остальных - как обычно"""
+
+    def __init__(self, stream):
+        self.stream = stream
+
+    def write(self, text: str) -> int:
+        buffer = getattr(_captured, "buffer", None)
+        return (buffer if buffer is not None else self.stream).write(text)
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+def captured_output(function, *args) -> Tuple[object, str]:
+    """Результат function(*args) и ее вывод в stdout из этого потока"""
+    _captured.buffer = io.StringIO()
+    try:
+        return function(*args), _captured.buffer.getvalue()
+    finally:
+        _captured.buffer = None
+
+def drain_stream(stream: Generator) -> Tuple[List[str], Optional[str]]:
+    """Все части потока и его возвращаемое значение"""
+    parts = []
+    while True:
+        try:
+            parts.append(next(stream))
+        except StopIteration as stop:
+            return parts, stop.value
+
+def replay_stream(parts: List[str], value: Optional[str]) -> Generator[str, None, Optional[str]]:
+    yield from parts
+    return value
+
+def timed_stream(stream: Generator[str, None, Optional[str]], stats: Dict,
+                 **attributes) -> Generator[str, None, Optional[str]]:
+    """Поток LLM с этапами llm_ttft (до первой части) и llm_generate (весь ответ)"""
+    start_time = time.perf_counter()
+    first_part = True
+    while True:
+        try:
+            part = next(stream)
+        except StopIteration as stop:
+            reason = stop.value
+            break
+        if first_part:
+            record_span("llm_ttft", time.perf_counter() - start_time, **attributes)
+            first_part = False
+        yield part
+
+    record_span("llm_generate", time.perf_counter() - start_time, degraded=reason,
+                prompt_eval_count=stats.get("prompt_eval_count"), eval_count=stats.get("eval_count"), **attributes)
+    return reason
 
 class RAGPipeline:
     def __init__(self):
         print("🔧 Инициализация RAG пайплайна...")
 
-        self.embed_model = SentenceTransformer(config.EMBEDDING_MODEL)
-        print(f"   ✅ Модель эмбеддингов загружена: {config.EMBEDDING_MODEL}")
-
-        self.client = chromadb.PersistentClient(path=config.VECTOR_DB_PATH)
-        self.collection = self.client.get_collection(config.COLLECTION_NAME)
-        print(f"   ✅ Векторная БД подключена: {self.collection.count()} чанков")
+        # Модель эмбеддингов и векторная БД загружаются при первом запросе (или load())
+        self._load_lock = threading.RLock()
+        self._embed_model = None
+        self._query_encoder = None
+        self.client = None
+        self._collection = None
+        self._injection_detector = None
+        self._reranker = None
+        self._summaries = None
+        self._small_model_available = None
+        self._small_model_retry_at = 0.0  # время следующей проверки, если Ollama не ответила
+        self.index_scanned = False  # чанки помечены build_index.py текущим набором шаблонов
+        self.sessions = SessionStore()
 
         self.llm_client = LLMClient(model=config.LLM_MODEL)
+        self.small_llm_client = LLMClient(model=config.LLM_SMALL_MODEL)
         print("   ✅ LLM клиент инициализирован")
 
         self.protection_enabled = True  # По умолчанию защита включена
         self.debug = False              # Флаг отладки
 
+    @property
+    def embed_model(self):
+        if self._embed_model is None:
+            with self._load_lock:
+                if self._embed_model is None:
+                    get_embedding_model = lazy_import("embedding_service").get_embedding_model
+                    self._embed_model = get_embedding_model(config.EMBEDDING_MODEL)
+                    print(f"   ✅ Модель эмбеддингов загружена: {config.EMBEDDING_MODEL}")
+        return self._embed_model
+
+    @property
+    def query_encoder(self):
+        if self._query_encoder is None:
+            with self._load_lock:
+                if self._query_encoder is None:
+                    # Одиночные запросы из параллельных потоков кодируются общими батчами
+                    if config.EMBED_MICROBATCH_ENABLED:
+                        EmbeddingBatcher = lazy_import("embedding_batcher").EmbeddingBatcher
+                        self._query_encoder = EmbeddingBatcher(self.embed_model)
+                    else:
+                        self._query_encoder = self.embed_model
+        return self._query_encoder
+
+    @property
+    def injection_detector(self):
+        if self._injection_detector is None:
+            with self._load_lock:
+                if self._injection_detector is None:
+                    InjectionDetector = lazy_import("injection_detector").InjectionDetector
+                    self._injection_detector = InjectionDetector(self.embed_model)
+        return self._injection_detector
+
+    @property
+    def reranker(self):
+        if self._reranker is None:
+            with self._load_lock:
+                if self._reranker is None:
+                    CrossEncoderReranker = lazy_import("reranker").CrossEncoderReranker
+                    self._reranker = CrossEncoderReranker()
+        return self._reranker
+
+    @property
+    def summaries(self) -> Dict[str, Dict]:
+        """Справки по документам из build_summaries.py: {файл: {title, hash, model, summary}}"""
+        if self._summaries is None:
+            with self._load_lock:
+                if self._summaries is None:
+                    summaries = {}
+                    if config.SUMMARIES_ENABLED and os.path.exists(config.SUMMARIES_PATH):
+                        with open(config.SUMMARIES_PATH, 'r', encoding='utf-8') as f:
+                            stored = json.load(f)
+                        current_summaries = lazy_import("build_summaries").current_summaries
+                        summaries = current_summaries(stored, config.SUMMARIES_SOURCE_FOLDER)
+                        print(f"   ✅ Справки по документам загружены: {len(summaries)}")
+                        if len(summaries) < len(stored):
+                            print(f"   ⚠️ Справок для измененных или удаленных документов: {len(stored) - len(summaries)} "
+                                  f"- не используются до запуска build_summaries.py")
+                    self._summaries = summaries
+        return self._summaries
+
+    @property
+    def collection(self):
+        if self._collection is None:
+            with self._load_lock:
+                if self._collection is None:
+                    chromadb = lazy_import("chromadb")
+                    with startup.measure("init", "векторная БД"):
+                        self.client = chromadb.PersistentClient(path=config.VECTOR_DB_PATH)
+                        collection = self.client.get_collection(config.COLLECTION_NAME)
+                    metadata = collection.metadata or {}
+                    self.index_scanned = metadata.get("injection_patterns") == get_scanner().signature
+                    self._collection = collection
+                    print(f"   ✅ Векторная БД подключена: {collection.count()} чанков")
+                    if not self.index_scanned:
+                        print("   ⚠️ Индекс создан без проверки на prompt injection (или с другими шаблонами): "
+                              "чанки будут проверяться при каждом запросе")
+        return self._collection
+
+    def load(self, open_index: bool = True) -> None:
+        """
+        Принудительная загрузка модели, индекса и LLM (для серверного режима);
+        open_index=False - без подключения к Chroma (родитель prefork-сервера)
+        """
+        self.query_encoder
+        if open_index:
+            self.collection
+        self.summaries
+        if config.INJECTION_DETECTOR_ENABLED:
+            self.injection_detector.centroids
+        if self.rerank_enabled():
+            self.reranker.model
+        if config.ROUTER_ENABLED:
+            self.small_model_available()
+        if config.LLM_WARMUP:
+            self.llm_client.warmup(self.system_prompt())
+            if config.ROUTER_ENABLED and self.small_model_available():
+                self.small_llm_client.warmup(self.system_prompt(use_cot=False))
+
+    def close_index(self) -> None:
+        """Закрытие клиента Chroma (родитель prefork-сервера проверяет индекс и закрывает его до fork())"""
+        if self.client is not None:
+            # Chroma кэширует систему по пути: без сброса воркер получил бы SQLite-соединение родителя
+            shared = getattr(sys.modules.get("chromadb.api.client"), "SharedSystemClient", None)
+            if shared is not None and hasattr(shared, "clear_system_cache"):
+                shared.clear_system_cache()
+        self.client = None
+        self._collection = None
+
+    def after_fork(self) -> None:
+        """Сброс потоков и соединений, унаследованных через fork() (prefork-режим)"""
+        self._load_lock = threading.RLock()
+        # SQLite-соединение Chroma нельзя использовать после fork(): каждый воркер подключается сам
+        self.client = None
+        self._collection = None
+        self._query_encoder = None  # поток микробатчера не переживает fork()
+        if self._injection_detector is not None:
+            self._injection_detector.lock = threading.Lock()
+        if self._reranker is not None:
+            self._reranker.lock = threading.Lock()
+        self.llm_client = LLMClient(model=config.LLM_MODEL)
+        self.small_llm_client = LLMClient(model=config.LLM_SMALL_MODEL)
+
+    def search_filter(self) -> Optional[Dict]:
+        """Фильтр where для Chroma: помеченные при индексации чанки не попадают в выдачу"""
+        self.collection  # index_scanned определяется при подключении к БД
+        if self.protection_enabled and self.index_scanned:
+            return {"flagged": False}
+        return None
+
+    def search_include(self) -> List[str]:
+        """Поля выдачи Chroma; векторы чанков нужны детектору prompt injection"""
+        include = ["documents", "metadatas", "distances"]
+        if self.protection_enabled and config.INJECTION_DETECTOR_ENABLED:
+            include.append("embeddings")
+        return include
+
+    def choose_k(self, distances: List[float]) -> int:
+        """
+        Сколько чанков оставить: обрезка по наибольшему разрыву расстояний
+        или по отношению к лучшему расстоянию в пределах [MIN, MAX]
+        """
+        low = max(1, min(config.ADAPTIVE_TOP_K_MIN, len(distances)))
+        high = min(config.ADAPTIVE_TOP_K_MAX, len(distances))
+        if high <= low:
+            return high
+
+        # Наибольший разрыв между соседями; чанк после разрыва в выдачу не входит
+        gaps = [distances[i] - distances[i - 1] for i in range(low, high + (high < len(distances)))]
+        k_gap = low + gaps.index(max(gaps)) if gaps and max(gaps) >= config.ADAPTIVE_TOP_K_MIN_GAP else high
+
+        limit = distances[0] * config.ADAPTIVE_TOP_K_RATIO
+        k_ratio = sum(1 for distance in distances[:high] if distance <= limit)
+
+        return max(low, min(k_gap, k_ratio, high))
+
+    def cut_results(self, results: Dict) -> Dict:
+        """Выдача одного запроса, обрезанная до адаптивного k"""
+        distances = (results.get("distances") or [[]])[0]
+        if not distances:
+            return results
+        k = self.choose_k(distances)
+        metrics.observe("retrieval_k", k, TOP_K_BUCKETS)
+        return {key: [results[key][0][:k]] for key in RESULT_KEYS if results.get(key) is not None}
+
+    def rerank_enabled(self) -> bool:
+        """Кросс-энкодер - настоящая модель с HF hub, при хэш-эмбеддингах (офлайн) не используется"""
+        return config.RERANK_ENABLED and config.EMBEDDING_BACKEND != "fake"
+
+    def adaptive_cut(self, n_results: int = None) -> bool:
+        """Адаптивный top-k по расстояниям - только без явного n_results и без переранжирования"""
+        return n_results is None and config.ADAPTIVE_TOP_K_ENABLED and not self.rerank_enabled()
+
+    def candidates_count(self, n_results: int = None) -> int:
+        if n_results is not None:
+            return n_results
+        if self.rerank_enabled():
+            return config.RERANK_CANDIDATES
+        if config.ADAPTIVE_TOP_K_ENABLED:
+            return config.ADAPTIVE_TOP_K_CANDIDATES
+        return config.SEARCH_RESULTS_COUNT
+
     def retrieve_chunks(self, query: str, n_results: int = None) -> Dict:
-        if n_results is None:
-            n_results = config.SEARCH_RESULTS_COUNT
+        """
+        Поиск чанков. Без явного n_results: при переранжировании - RERANK_CANDIDATES кандидатов
+        для кросс-энкодера, иначе при ADAPTIVE_TOP_K_ENABLED k выбирается по расстояниям
+        """
+        adaptive = self.adaptive_cut(n_results)
+        n_results = self.candidates_count(n_results)
 
         try:
-            query_embedding = self.embed_model.encode([query]).tolist()
-            results = self.collection.query(
-                query_embeddings=query_embedding,
-                n_results=n_results,
-                include=["documents", "metadatas", "distances"]
-            )
+            with span("embed", queries=1, microbatch=config.EMBED_MICROBATCH_ENABLED):
+                query_embedding = self.query_encoder.encode([query]).tolist()
+            with span("vector_query", n_results=n_results) as attributes:
+                results = self.collection.query(
+                    query_embeddings=query_embedding,
+                    n_results=n_results,
+                    where=self.search_filter(),
+                    include=self.search_include()
+                )
+                if adaptive:
+                    results = self.cut_results(results)
+                attributes["chunks"] = len((results.get("ids") or [[]])[0])
             return results
         except Exception as e:
             print(f"❌ Ошибка при поиске чанков: {e}")
             return {"documents": [], "metadatas": [], "distances": []}
 
+    def retrieve_chunks_batch(self, queries: List[str], n_results: int = None) -> List[Dict]:
+        """Один батч эмбеддингов и один запрос к БД на весь список вопросов"""
+        adaptive = self.adaptive_cut(n_results)
+        n_results = self.candidates_count(n_results)
+
+        try:
+            with span("embed", queries=len(queries)):
+                query_embeddings = self.embed_model.encode(
+                    queries, batch_size=config.BATCH_ENCODE_SIZE
+                ).tolist()
+            with span("vector_query", queries=len(queries), n_results=n_results):
+                results = self.collection.query(
+                    query_embeddings=query_embeddings,
+                    n_results=n_results,
+                    where=self.search_filter(),
+                    include=self.search_include()
+                )
+        except Exception as e:
+            print(f"❌ Ошибка при пакетном поиске чанков: {e}")
+            return [{"documents": [], "metadatas": [], "distances": []} for _ in queries]
+
+        # Раскладываем ответ по вопросам в том же формате, что и retrieve_chunks
+        keys = [key for key in RESULT_KEYS if results.get(key) is not None]
+        split = [{key: [results[key][i]] for key in keys} for i in range(len(queries))]
+        return [self.cut_results(r) for r in split] if adaptive else split
+
     def is_relevant(self, distances: List[float]) -> bool:
         if not distances:
             return False
         return min(distances) <= config.RELEVANCE_THRESHOLD
 
-    def filter_malicious_chunks(self, chunks: List[str]) -> List[str]:
+    def chunks_from_results(self, results: Dict) -> List[Dict]:
+        """Чанки выдачи в порядке релевантности: id, текст, метаданные, расстояние"""
+        documents = results["documents"][0]
+        ids = (results.get("ids") or [[]])[0] or [str(i) for i in range(len(documents))]
+        metadatas = (results.get("metadatas") or [[]])[0] or [{}] * len(documents)
+        distances = (results.get("distances") or [[]])[0] or [None] * len(documents)
+        embeddings = results.get("embeddings")
+        embeddings = embeddings[0] if embeddings is not None else [None] * len(documents)
+        return [
+            {"id": chunk_id, "text": text, "metadata": metadata or {}, "distance": distance, "embedding": embedding}
+            for chunk_id, text, metadata, distance, embedding in zip(ids, documents, metadatas, distances, embeddings)
+        ]
+
+    def fetch_embeddings(self, ids: List[str]) -> Dict[str, List[float]]:
+        """Векторы чанков из коллекции (если выдача пришла без embeddings)"""
+        stored = self.collection.get(ids=ids, include=["embeddings"])
+        return dict(zip(stored["ids"], stored["embeddings"]))
+
+    def filter_malicious_chunks(self, chunks: List[Dict]) -> List[Dict]:
+        """
+        Шаблоны проверяются при запросе только для индексов, созданных без сканирования:
+        в просканированном индексе помеченные чанки уже исключены фильтром where.
+        Затем векторы чанков сравниваются с примерами атак (InjectionDetector).
+        """
         if not self.protection_enabled:
             return chunks
 
-        safe_chunks = []
-        for chunk in chunks:
-            lowered = chunk.lower()
-            if any(word in lowered for word in [
-                "ignore all instructions",
-                "output:",
-                "суперпароль",
-                "root"
-            ]):
-                print("🚫 Вредоносный чанк отфильтрован.")
-                continue
-            safe_chunks.append(chunk)
-        return safe_chunks
-
-    def prepare_prompt(self, query: str, context_chunks: List[str]) -> str:
-        return build_rag_prompt(
-            question=query,
-            context_chunks=context_chunks,
-            use_cot=config.ENABLE_CHAIN_OF_THOUGHT,
+        if not self.index_scanned:
+            scanner = get_scanner()
+            safe_chunks = []
+            for chunk in chunks:
+                if scanner.is_flagged(chunk["text"]):
+                    print("🚫 Вредоносный чанк отфильтрован.")
+                    continue
+                safe_chunks.append(chunk)
+            chunks = safe_chunks
+
+        if config.INJECTION_DETECTOR_ENABLED and chunks:
+            verdicts = self.injection_detector.classify(chunks, self.fetch_embeddings)
+            for chunk in chunks:
+                if verdicts[chunk["id"]]:
+                    print(f"🚫 Чанк похож на prompt injection ({verdicts[chunk['id']]}), отфильтрован.")
+            chunks = [chunk for chunk in chunks if not verdicts[chunk["id"]]]
+        return chunks
+
+    def rerank_chunks(self, query: str, chunks: List[Dict]) -> List[Dict]:
+        """Лучшие RERANK_TOP_N чанков по оценке кросс-энкодера; экономия токенов в метриках"""
+        if not self.rerank_enabled() or len(chunks) <= config.RERANK_TOP_N:
+            return chunks
+
+        with span("rerank", chunks_in=len(chunks)) as attributes:
+            reranked = self.reranker.rerank(query, chunks)
+            tokens_before = sum(count_tokens(chunk["text"]) for chunk in chunks)
+            tokens_after = sum(count_tokens(chunk["text"]) for chunk in reranked)
+            attributes.update(chunks_out=len(reranked), tokens_before=tokens_before, tokens_after=tokens_after)
+        metrics.inc("rerank_tokens_saved_total", tokens_before - tokens_after)
+        return reranked
+
+    def system_prompt(self, use_cot: bool = None) -> str:
+        """Статический префикс, передаваемый в Ollama как system"""
+        return build_system_prompt(
+            use_cot=config.ENABLE_CHAIN_OF_THOUGHT if use_cot is None else use_cot,
             protection_enabled=self.protection_enabled
         )
 
-    def generate_response(self, query: str, context_chunks: List[str]) -> str:
-        if not context_chunks:
-            return "🤷 В базе знаний нет информации для ответа на этот вопрос"
+    def build_prompt(self, query: str, context_chunks: List[Dict], use_cot: bool) -> str:
+        """Упакованный контекст и вопрос без трассировки и метрик"""
+        if config.CONTEXT_PACKING_ENABLED:
+            context_blocks = pack_context(context_chunks)
+        else:
+            context_blocks = [chunk["text"] for chunk in context_chunks]
 
-        prompt = self.prepare_prompt(query, context_chunks)
+        return build_user_prompt(
+            question=query,
+            context_chunks=context_blocks,
+            use_cot=use_cot
+        )
+
+    def prepare_prompt(self, query: str, context_chunks: List[Dict], use_cot: bool = None) -> str:
+        """Изменяемая часть промпта: упакованный контекст и вопрос"""
+        if use_cot is None:
+            use_cot = config.ENABLE_CHAIN_OF_THOUGHT
+        with span("prompt_build", chunks=len(context_chunks), packed=config.CONTEXT_PACKING_ENABLED) as attributes:
+            prompt = self.build_prompt(query, context_chunks, use_cot)
+            prompt_tokens = count_tokens(self.system_prompt(use_cot)) + count_tokens(prompt)
+            attributes["prompt_tokens"] = prompt_tokens
+        metrics.observe("prompt_tokens", prompt_tokens, TOKEN_BUCKETS)
+        return prompt
+
+    def deadline_at(self, deadline: float = None) -> Optional[float]:
+        """Момент (time.monotonic()), к которому запрос должен быть обработан"""
+        budget = deadline if deadline is not None else config.QUERY_DEADLINE_S
+        return time.monotonic() + budget if budget else None
+
+    def stream_response(self, query: str, context_chunks: List[Dict],
+                        deadline_at: float = None) -> Generator[str, None, Optional[str]]:
+        """
+        Части ответа LLM по мере генерации. Если генерация оборвалась по дедлайну
+        или ошибке, добавляется пометка к частичному ответу либо fallback_response.
+        Возвращаемое значение генератора - причина деградации или None.
+        """
+        route = self.route(query, context_chunks)
+        stream = self.llm_stream(query, context_chunks, route, deadline_at)
+
+        if route["tier"] == "small" and config.ROUTER_ESCALATE_ON_UNKNOWN:
+            # Ответ малой модели копится целиком: при "Я не знаю" вопрос уходит большой модели
+            parts, reason = drain_stream(stream)
+            if reason is None and is_unknown("".join(parts)):
+                metrics.inc("router_escalations_total")
+                print("⬆️ Малая модель не нашла ответ, вопрос передается большой модели")
+                stream = self.llm_stream(query, context_chunks, large_route("эскалация"), deadline_at)
+            else:
+                stream = replay_stream(parts, reason)
+
+        return (yield from self.guarded_stream(query, context_chunks, stream))
+
+    def guarded_stream(self, query: str, context_chunks: List[Dict],
+                       stream: Generator[str, None, Optional[str]]) -> Generator[str, None, Optional[str]]:
+        """Поток LLM с пометкой или fallback_response при обрыве; возвращает причину деградации"""
+        produced = False
+        while True:
+            try:
+                part = next(stream)
+            except StopIteration as stop:
+                reason = stop.value
+                break
+            produced = True
+            yield part
+
+        if reason is None:
+            return None
+
+        degraded = f"{reason}_partial" if produced else f"{reason}_fallback"
+        metrics.inc(f'query_degraded_total{{reason="{degraded}"}}')
+        print(f"⏱️ Ответ LLM не получен полностью ({reason}), возвращается "
+              f"{'частичный ответ' if produced else 'извлеченный фрагмент контекста'}")
+        if produced:
+            yield PARTIAL_SUFFIXES[reason]
+        else:
+            yield self.fallback_response(query, context_chunks)
+        return degraded
+
+    def small_model_available(self) -> bool:
+        """
+        Малая модель установлена в Ollama; без нее маршрутизация отключается.
+        Проверяется в load(); если Ollama не ответила, модель считается установленной
+        до повторной проверки через ROUTER_AVAILABILITY_RETRY_S. Вызов может блокировать
+        на время HTTP-запроса: в async-пайплайне он выполняется в пуле потоков.
+        """
+        if self._small_model_available is not None:
+            return self._small_model_available
+        now = time.monotonic()
+        if now < self._small_model_retry_at:
+            return True
+        self._small_model_retry_at = now + config.ROUTER_AVAILABILITY_RETRY_S  # параллельные запросы не повторяют проверку
+        available = self.small_llm_client.is_available(timeout=config.ROUTER_AVAILABILITY_TIMEOUT_S)
+        if available is None:
+            print(f"⚠️ Ollama не ответила на /api/tags, проверка {config.LLM_SMALL_MODEL} "
+                  f"повторится через {config.ROUTER_AVAILABILITY_RETRY_S} сек")
+            return True
+        if not available:
+            print(f"⚠️ Модель {config.LLM_SMALL_MODEL} не установлена (ollama pull {config.LLM_SMALL_MODEL}), "
+                  f"все вопросы обслуживает {config.LLM_MODEL}")
+        self._small_model_available = available
+        return available
+
+    def route(self, query: str, context_chunks: List[Dict]) -> Dict:
+        """Малая модель без CoT для простых вопросов, большая с CoT - для остальных"""
+        if config.ROUTER_ENABLED and not self.small_model_available():
+            route = large_route("малая модель не установлена")
+        else:
+            route = route_query(
+                query,
+                [chunk["distance"] for chunk in context_chunks if chunk.get("distance") is not None],
+                [chunk["metadata"].get("source") for chunk in context_chunks]
+            )
+        print(f"🧭 Модель: {route['model']} ({route['reason']}, CoT: {'да' if route['use_cot'] else 'нет'})")
+        annotate(route_reason=route["reason"], use_cot=route["use_cot"])
+        return route
+
+    def llm_stream(self, query: str, context_chunks: List[Dict], route: Dict,
+                   deadline_at: float = None) -> Generator[str, None, Optional[str]]:
+        """Поток ответа модели, выбранной маршрутом"""
+        prompt = self.prepare_prompt(query, context_chunks, route["use_cot"])
+        system_prompt = self.system_prompt(route["use_cot"])
 
         if self.debug:
             print("\n📝 Финальный промпт, переданный в LLM:")
             print("=" * 60)
+            print(system_prompt)
+            print("-" * 60)
             print(prompt)
             print("=" * 60)
 
+        metrics.inc(f'answer_path_total{{path="llm_{route["tier"]}"}}')
+        annotate(path=f"llm_{route['tier']}", model=route["model"])
+        llm_client = self.small_llm_client if route["tier"] == "small" else self.llm_client
+        stats = {}
+        stream = llm_client.generate_stream(prompt, system_prompt=system_prompt, deadline_at=deadline_at, stats=stats)
+        return timed_stream(stream, stats, model=route["model"])
+
+    def generate_answer(self, query: str, context_chunks: List[Dict],
+                        deadline_at: float = None) -> Tuple[str, Optional[str]]:
+        """Ответ LLM и причина деградации (None, если ответ получен полностью)"""
+        if not context_chunks:
+            return "🤷 В базе знаний нет информации для ответа на этот вопрос", None
+
+        direct = self.direct_answer(query, context_chunks)
+        if direct is not None:
+            return direct, None
+
         print("🧠 Генерация ответа через LLM...")
-        start_time = time.time()
-        response = self.llm_client.generate(prompt)
-        duration = time.time() - start_time
-        print(f"   ✅ Ответ сгенерирован за {duration:.2f} сек")
+        parts, degraded = drain_stream(self.stream_response(query, context_chunks, deadline_at))
+        return "".join(parts).strip(), degraded
+
+    def generate_response(self, query: str, context_chunks: List[Dict]) -> str:
+        return self.generate_answer(query, context_chunks, self.deadline_at())[0]
+
+    def extract(self, query: str, chunk: Dict) -> Optional[str]:
+        """Предложения чанка о сущности из вопроса "Кто такой X?" в шаблоне RESPONSE_TEMPLATES"""
+        parsed = parse_simple_question(query)
+        if parsed is None:
+            return None
+        kind, entity = parsed
+        answer = extract_answer(entity, chunk["text"], config.EXTRACTIVE_MAX_SENTENCES)
+        if answer is None:
+            return None
+        return get_response_template(kind).format(character=entity, answer=answer)
+
+    def confidence(self, context_chunks: List[Dict]) -> float:
+        """Уверенность выдачи: 1 - расстояние до лучшего чанка"""
+        distances = [chunk["distance"] for chunk in context_chunks if chunk.get("distance") is not None]
+        return 1 - min(distances) if distances else 0.0
+
+    def dominant_source(self, entity: str, context_chunks: List[Dict]) -> Optional[str]:
+        """
+        Документ, на который явно указывает выдача: документ лучшего чанка, если сущность
+        из вопроса есть в его названии или из него не меньше SUMMARY_MIN_SOURCE_SHARE чанков
+        """
+        sources = [chunk["metadata"].get("source") for chunk in context_chunks]
+        source = sources[0]
+        if not source:
+            return None
+        title = context_chunks[0]["metadata"].get("title") or os.path.splitext(source)[0].replace("_", " ")
+        if entity_coverage(stems(entity), title) >= 0.5:
+            return source
+        if len(sources) > 1 and sources.count(source) / len(sources) >= config.SUMMARY_MIN_SOURCE_SHARE:
+            return source
+        return None
+
+    def summary_answer(self, query: str, context_chunks: List[Dict]) -> Optional[str]:
+        """Готовая справка по документу (build_summaries.py), если выдача указывает на один документ"""
+        parsed = parse_simple_question(query)
+        if parsed is None or not self.summaries:
+            return None
+        kind, entity = parsed
+
+        source = self.dominant_source(entity, context_chunks)
+        entry = self.summaries.get(source) if source else None
+        if entry is None:
+            return None
+
+        metrics.inc('answer_path_total{path="summary"}')
+        annotate(path="summary")
+        print(f"📚 Путь ответа: готовая справка по документу {source}")
+        return get_response_template(kind).format(character=entity, answer=entry["summary"])
+
+    def extractive_answer(self, query: str, context_chunks: List[Dict]) -> Optional[str]:
+        """Ответ из предложений лучшего чанка (уверенность выдачи проверяет direct_answer)"""
+        if not config.EXTRACTIVE_ENABLED or parse_simple_question(query) is None:
+            return None
+
+        confidence = self.confidence(context_chunks)
+        answer = self.extract(query, context_chunks[0])
+        if answer is None:
+            print("🧭 Путь ответа: LLM (в лучшем чанке нет предложений о сущности из вопроса)")
+            return None
+
+        metrics.inc('answer_path_total{path="extractive"}')
+        annotate(path="extractive", confidence=round(confidence, 3))
+        print(f"⚡ Путь ответа: извлечение без LLM (уверенность {confidence:.2f})")
+        return answer
+
+    def direct_answer(self, query: str, context_chunks: List[Dict]) -> Optional[str]:
+        """
+        Ответ без вызова LLM на простой вопрос при уверенной выдаче:
+        готовая справка по документу, иначе предложения из лучшего чанка
+        """
+        if parse_simple_question(query) is None:
+            return None
 
-        return response
+        confidence = self.confidence(context_chunks)
+        if confidence < config.CONFIDENCE_THRESHOLD:
+            print(f"🧭 Путь ответа: LLM (уверенность {confidence:.2f} < {config.CONFIDENCE_THRESHOLD})")
+            return None
 
-    def fallback_response(self, query: str, context_chunks: List[str]) -> str:
+        answer = self.summary_answer(query, context_chunks)
+        if answer is None:
+            answer = self.extractive_answer(query, context_chunks)
+        return answer
+
+    def fallback_response(self, query: str, context_chunks: List[Dict]) -> str:
         if not context_chunks:
             return "🤷 Я не знаю ответ на этот вопрос"
 
-        main_answer = context_chunks[0]
+        extracted = self.extract(query, context_chunks[0])
+        if extracted is not None:
+            return extracted
+
+        _, main_answer = split_header(context_chunks[0]["text"])
         if len(main_answer) > 300:
             main_answer = main_answer[:300] + "..."
 
         template = get_response_template("general")
         return template.format(answer=main_answer)
 
-    def process_query(self, query: str) -> str:
+    def prepare_context(self, query: str, results: Dict = None) -> Tuple[Optional[List[Dict]], Optional[str]]:
+        """Поиск и фильтрация чанков: (чанки, None) либо (None, готовый ответ)"""
         print(f"🔍 Обработка запроса: '{query}'")
 
-        results = self.retrieve_chunks(query)
+        if results is None:
+            results = self.retrieve_chunks(query)
 
         if not results or not results.get("documents") or not results["documents"][0]:
-            return "🤷 По вашему запросу ничего не найдено"
+            return None, "🤷 По вашему запросу ничего не найдено"
 
         distances = results.get("distances", [[]])[0]
         if not self.is_relevant(distances):
-            return "🤷 Я не знаю ответ на этот вопрос"
+            return None, "🤷 Я не знаю ответ на этот вопрос"
 
-        raw_chunks = results["documents"][0]
+        raw_chunks = self.chunks_from_results(results)
 
         if self.debug:
             print("\n📦 Найденные чанки:")
             for ch in raw_chunks:
-                print(f"{ch[:200]}...\n")
+                print(f"{ch['text'][:200]}...\n")
 
-        filtered_chunks = self.filter_malicious_chunks(raw_chunks)
+        with span("filter", chunks_in=len(raw_chunks)) as attributes:
+            filtered_chunks = self.filter_malicious_chunks(raw_chunks)
+            attributes["chunks_out"] = len(filtered_chunks)
 
         if self.debug:
             print("✅ Отфильтрованные чанки:")
             for ch in filtered_chunks:
-                print(f"{ch[:200]}...\n")
+                print(f"{ch['text'][:200]}...\n")
 
         if not filtered_chunks:
-            return "🤖 Контекст найден, но был отфильтрован по соображениям безопасности"
+            return None, "🤖 Контекст найден, но был отфильтрован по соображениям безопасности"
+
+        return self.rerank_chunks(query, filtered_chunks), None
+
+    def answer_query(self, query: str, results: Dict = None, retrieval_time: float = None,
+                     deadline: float = None) -> Dict:
+        """Ответ вместе с идентификаторами чанков, расстояниями и временем этапов"""
+        deadline_at = self.deadline_at(deadline)
+
+        with trace("query", question=query) as current:
+            if results is None:
+                results = self.retrieve_chunks(query)
+            elif retrieval_time is not None:
+                # Поиск выполнен блоком в process_queries: доля блока на один вопрос
+                record_span("vector_query", retrieval_time, batched=True)
+
+            context_chunks, early_response = self.prepare_context(query, results)
+
+            degraded = None
+            if early_response is not None:
+                answer = early_response
+                annotate(path="early")
+            else:
+                answer, degraded = self.generate_answer(query, context_chunks, deadline_at)
+
+        if self.debug:
+            print(f"⏱️ Этапы: {current.summary()}")
+
+        return {
+            "question": query,
+            "answer": answer,
+            "chunk_ids": (results.get("ids") or [[]])[0],
+            "distances": (results.get("distances") or [[]])[0],
+            "degraded": degraded,
+            "timings": current.timings()
+        }
+
+    def process_query(self, query: str, deadline: float = None) -> str:
+        return self.answer_query(query, deadline=deadline)["answer"]
+
+    def chat(self, query: str, session_id: str = "default", deadline: float = None) -> str:
+        """
+        Ход диалога: первый ход - полный промпт, следующие передают Ollama массив context
+        прошлых ходов и только новый вопрос с еще не показанными модели чанками.
+        Сессии всегда обслуживает большая модель: context привязан к модели.
+        """
+        with trace("chat", question=query, session_id=session_id):
+            session = self.sessions.get(session_id)
+            deadline_at = self.deadline_at(deadline)
+            context_chunks, early_response = self.prepare_context(query)
+            if early_response is not None:
+                return early_response
+
+            direct = self.direct_answer(query, context_chunks)
+            if direct is not None:
+                return direct
+
+            new_chunks = [chunk for chunk in context_chunks if chunk["id"] not in session.seen_chunk_ids]
+            use_cot = config.ENABLE_CHAIN_OF_THOUGHT
+            if session.context:
+                # Полный промпт только для оценки экономии: в prompt_build и prompt_tokens он не попадает
+                full_prompt = self.build_prompt(query, context_chunks, use_cot)
+            else:
+                full_prompt = self.prepare_prompt(query, context_chunks, use_cot)
+            full_tokens = count_tokens(self.system_prompt(use_cot)) + count_tokens(full_prompt)
+
+            if session.context:
+                blocks = pack_context(new_chunks) if config.CONTEXT_PACKING_ENABLED and new_chunks else \
+                    [chunk["text"] for chunk in new_chunks]
+                prompt, system_prompt = build_followup_prompt(query, blocks, use_cot), ""
+                sent_tokens = count_tokens(prompt)
+            else:
+                prompt, system_prompt = full_prompt, self.system_prompt(use_cot)
+                sent_tokens = full_tokens
+
+            print(f"🧠 Генерация ответа через LLM (сессия {session_id}, ход {session.turns + 1})...")
+            metrics.inc('answer_path_total{path="llm_session"}')
+            annotate(path="llm_session", model=config.LLM_MODEL,
+                     session_turn=session.turns + 1, prompt_tokens_sent=sent_tokens)
+            stats = {}
+            stream = timed_stream(self.llm_client.generate_stream(
+                prompt, system_prompt=system_prompt, deadline_at=deadline_at, context=session.context, stats=stats
+            ), stats, model=config.LLM_MODEL)
+            parts, degraded = drain_stream(self.guarded_stream(query, context_chunks, stream))
+
+            if degraded is None:
+                session.update(stats.get("context"), [chunk["id"] for chunk in new_chunks])
+                saved = full_tokens - sent_tokens
+                metrics.inc("session_prefill_tokens_saved_total", saved)
+                print(f"♻️ Сессия: отправлено ~{sent_tokens} токенов вместо ~{full_tokens} "
+                      f"(экономия ~{saved}), prefill в Ollama: {stats.get('prompt_eval_count', 0)} токенов, "
+                      f"новых чанков {len(new_chunks)} из {len(context_chunks)}")
+            return "".join(parts).strip()
+
+    def stream_query(self, query: str, deadline: float = None) -> Iterator[str]:
+        """Ответ по частям по мере генерации LLM"""
+        with trace("stream", question=query):
+            deadline_at = self.deadline_at(deadline)
+            context_chunks, early_response = self.prepare_context(query)
+            if early_response is not None:
+                yield early_response
+                return
+
+            direct = self.direct_answer(query, context_chunks)
+            if direct is not None:
+                yield direct
+                return
+
+            yield from self.stream_response(query, context_chunks, deadline_at)
+
+    def process_queries(self, queries: List[str], parallelism: int = None, deadline: float = None) -> Iterator[Dict]:
+        """
+        Пакетная обработка: эмбеддинги и поиск блоками, генерация параллельно.
+        Записи answer_query выдаются в порядке вопросов по мере готовности: следующий
+        блок ищется, когда в работе остается не больше 2 * parallelism вопросов,
+        поэтому в памяти одновременно не больше блока и этого окна.
+        Диагностика параллельных вопросов не перемешивается в stdout: вывод каждого
+        вопроса собирается в record["log"] и выдается вместе с записью.
+        """
+        parallelism = parallelism or config.BATCH_LLM_PARALLELISM
+        block_size = config.BATCH_RETRIEVAL_SIZE
+        window = parallelism * 2
+
+        def answer(query: str, results: Dict, retrieval_time: float) -> Dict:
+            record, log = captured_output(self.answer_query, query, results, retrieval_time, deadline)
+            record["log"] = log
+            return record
+
+        stdout = sys.stdout
+        if not isinstance(stdout, CapturingStdout):
+            sys.stdout = CapturingStdout(stdout)
+        try:
+            with ThreadPoolExecutor(max_workers=parallelism, thread_name_prefix="rag-llm") as executor:
+                pending = deque()
+                for start in range(0, len(queries), block_size):
+                    while len(pending) > window:
+                        yield pending.popleft().result()
+
+                    block = queries[start:start + block_size]
+                    start_time = time.time()
+                    block_results = self.retrieve_chunks_batch(block)
+                    # Время пакетного поиска делится поровну между вопросами блока
+                    retrieval_time = (time.time() - start_time) / max(len(block), 1)
+                    for query, results in zip(block, block_results):
+                        pending.append(executor.submit(answer, query, results, retrieval_time))
 
-        return self.generate_response(query, filtered_chunks)
+                while pending:
+                    yield pending.popleft().result()
+        finally:
+            sys.stdout = stdout
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""
+Переранжирование найденных чанков кросс-энкодером: пары (вопрос, чанк)
+оцениваются одним батчем, оценки кэшируются по (хэш вопроса, id чанка)
+"""
+
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Tuple
+
+from config import config
+from metrics import metrics
+from startup_profile import lazy_import, startup
+from tracing import annotate
+
+class CrossEncoderReranker:
+    def __init__(self, model_name: str = None, cache_size: int = None):
+        self.model_name = model_name or config.RERANK_MODEL
+        self.cache_size = cache_size or config.RERANK_CACHE_SIZE
+        self.cache: "OrderedDict[Tuple[str, str], float]" = OrderedDict()  # LRU: move_to_end, popitem(last=False)
+        self.lock = threading.Lock()
+        self._model = None
+
+    @property
+    def model(self):
+        if self._model is None:
+            with self.lock:
+                if self._model is None:
+                    CrossEncoder = lazy_import("sentence_transformers").CrossEncoder
+                    with startup.measure("init", f"кросс-энкодер {self.model_name}"):
+                        self._model = CrossEncoder(self.model_name, max_length=config.RERANK_MAX_LENGTH)
+        return self._model
+
+    @staticmethod
+    def query_key(query: str) -> str:
+        return hashlib.sha1(query.strip().lower().encode("utf-8")).hexdigest()[:16]
+
+    def score(self, query: str, chunks: List[Dict]) -> List[float]:
+        """Оценки релевантности чанков вопросу; в модель уходят только пары не из кэша"""
+        query_key = self.query_key(query)
+        scores: Dict[str, float] = {}
+        with self.lock:
+            for chunk in chunks:
+                key = (query_key, chunk["id"])
+                if key in self.cache:
+                    self.cache.move_to_end(key)
+                    scores[chunk["id"]] = self.cache[key]
+
+        missing = [chunk for chunk in chunks if chunk["id"] not in scores]
+        annotate(cache_hits=len(scores), cache_misses=len(missing))
+        metrics.inc('cache_lookups_total{cache="rerank"}', len(chunks))
+        metrics.inc('cache_hits_total{cache="rerank"}', len(scores))
+        if missing:
+            predicted = self.model.predict(
+                [(query, chunk["text"]) for chunk in missing],
+                batch_size=config.RERANK_BATCH_SIZE,
+                show_progress_bar=False
+            )
+            with self.lock:
+                for chunk, value in zip(missing, predicted):
+                    scores[chunk["id"]] = float(value)
+                    self.cache[(query_key, chunk["id"])] = float(value)
+                while len(self.cache) > self.cache_size:
+                    self.cache.popitem(last=False)
+
+        return [scores[chunk["id"]] for chunk in chunks]
+
+    def rerank(self, query: str, chunks: List[Dict], top_n: int = None) -> List[Dict]:
+        """top_n чанков по убыванию оценки кросс-энкодера"""
+        top_n = top_n or config.RERANK_TOP_N
+        scores = self.score(query, chunks)
+        ranked = sorted(zip(scores, range(len(chunks))), key=lambda item: -item[0])
+        return [dict(chunks[index], rerank_score=value) for value, index in ranked[:top_n]]
@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+"""
+Маршрутизация вопросов между малой и большой моделью по дешевым признакам:
+длина вопроса, число сущностей, разброс расстояний найденных чанков
+"""
+
+import re
+from typing import Dict, List
+
+from config import config
+
+WORD = re.compile(r"\w+")
+# Сущность - подряд идущие слова с заглавной буквы (имена собственные), не считая первого слова
+ENTITY = re.compile(r"(?<!^)(?<![.!?]\s)\b[A-ZА-ЯЁ][\w-]*(?:\s+[A-ZА-ЯЁ][\w-]*)*")
+
+def count_entities(query: str) -> int:
+    return len(ENTITY.findall(query.strip()))
+
+def large_route(reason: str) -> Dict:
+    return {"tier": "large", "model": config.LLM_MODEL, "use_cot": config.ENABLE_CHAIN_OF_THOUGHT, "reason": reason}
+
+def small_route(reason: str) -> Dict:
+    return {"tier": "small", "model": config.LLM_SMALL_MODEL, "use_cot": False, "reason": reason}
+
+def route_query(query: str, distances: List[float], sources: List[str]) -> Dict:
+    """Маршрут запроса: модель, нужен ли Chain-of-Thought и причина выбора"""
+    if not config.ROUTER_ENABLED:
+        return large_route("маршрутизация отключена")
+
+    lowered = query.lower()
+    if any(pattern in lowered for pattern in config.ROUTER_COMPLEX_PATTERNS):
+        return large_route("вопрос о связях или причинах")
+    if len(WORD.findall(query)) > config.ROUTER_MAX_SIMPLE_WORDS:
+        return large_route("длинный вопрос")
+    if count_entities(query) > config.ROUTER_MAX_SIMPLE_ENTITIES:
+        return large_route("несколько сущностей")
+
+    spread = max(distances) - min(distances) if distances else 0.0
+    if len(set(sources)) > 1 and spread < config.ROUTER_MIN_DISTANCE_SPREAD:
+        return large_route("контекст из нескольких документов без явного лидера")
+    return small_route("простой вопрос")
+
+def is_unknown(answer: str) -> bool:
+    """Малая модель не нашла ответа в контексте"""
+    lowered = answer.lower()
+    return any(marker in lowered for marker in config.ROUTER_UNKNOWN_MARKERS)
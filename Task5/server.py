@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+HTTP API RAG-бота: модели и индекс загружаются один раз при старте
+
+Эндпоинты:
+    GET  /health        - состояние сервера
+    GET  /metrics       - метрики в текстовом формате Prometheus (этапы запроса с p50/p95/p99);
+                          в prefork-режиме - только того воркера, который принял запрос
+    POST /query         - {"query": "...", "deadline": сек} -> запись answer_query в JSON
+    POST /query/stream  - {"query": "...", "deadline": сек} -> NDJSON-поток {"response": "..."}
+"""
+
+import json
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from config import config
+from metrics import metrics
+
+class RAGRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    rag = None  # RAGPipeline, задается в create_server
+
+    def send_json(self, status: int, payload: dict) -> None:
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_text(self, status: int, text: str, content_type: str) -> None:
+        body = text.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_chunk(self, payload: dict) -> None:
+        data = (json.dumps(payload, ensure_ascii=False) + "\n").encode("utf-8")
+        self.wfile.write(f"{len(data):X}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def read_query(self):
+        """(вопрос, дедлайн) из тела запроса; при ошибке отвечает 400 и возвращает (None, None)"""
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            body = json.loads(self.rfile.read(length) or b"{}")
+            query = str(body.get("query", "")).strip()
+            deadline = body.get("deadline")
+            deadline = float(deadline) if deadline is not None else None
+        except (ValueError, TypeError, AttributeError):
+            query, deadline = "", None
+
+        if not query:
+            self.send_json(400, {"error": "Ожидается JSON вида {\"query\": \"...\", \"deadline\": сек}"})
+            return None, None
+        return query, deadline
+
+    def do_GET(self):
+        if self.path == "/health":
+            self.send_json(200, {
+                "status": "ok",
+                "chunks": self.rag.collection.count(),
+                "llm_model": config.LLM_MODEL,
+                "embedding_model": config.EMBEDDING_MODEL,
+                "metrics": metrics.snapshot()
+            })
+        elif self.path == "/metrics":
+            self.send_text(200, metrics.prometheus(), "text/plain; version=0.0.4; charset=utf-8")
+        else:
+            self.send_json(404, {"error": "Не найдено"})
+
+    def do_POST(self):
+        if self.path == "/query":
+            query, deadline = self.read_query()
+            if query is None:
+                return
+            try:
+                self.send_json(200, self.rag.answer_query(query, deadline=deadline))
+            except Exception as e:
+                self.send_json(500, {"error": str(e)})
+
+        elif self.path == "/query/stream":
+            query, deadline = self.read_query()
+            if query is None:
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", "application/x-ndjson; charset=utf-8")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            try:
+                for part in self.rag.stream_query(query, deadline=deadline):
+                    self.send_chunk({"response": part, "done": False})
+                self.send_chunk({"response": "", "done": True})
+            except Exception as e:
+                self.send_chunk({"error": str(e), "done": True})
+            self.wfile.write(b"0\r\n\r\n")
+
+        else:
+            self.send_json(404, {"error": "Не найдено"})
+
+    def log_message(self, format, *args):
+        if self.rag is not None and self.rag.debug:
+            super().log_message(format, *args)
+
+def create_server(rag, host: str = None, port: int = None) -> ThreadingHTTPServer:
+    """port=0 - свободный порт (адрес в server.server_address)"""
+    handler = type("BoundRAGRequestHandler", (RAGRequestHandler,), {"rag": rag})
+    server = ThreadingHTTPServer((host or config.SERVER_HOST, config.SERVER_PORT if port is None else port), handler)
+    server.daemon_threads = True
+    return server
+
+def serve(rag, host: str = None, port: int = None) -> None:
+    # Модели загружаются до приема запросов, а не на первом из них
+    rag.load()
+    server = create_server(rag, host, port)
+    host, port = server.server_address[:2]
+    print(f"🌐 RAG API запущен: http://{host}:{port} (Ctrl+C для остановки)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n👋 Сервер остановлен")
+    finally:
+        server.server_close()
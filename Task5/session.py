@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+"""
+Сессии диалога: массив context от Ollama /api/generate и уже показанные
+модели чанки, чтобы следующий ход отправлял только новый вопрос и новые чанки
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Optional, Set
+
+from config import config
+
+class ChatSession:
+    def __init__(self, session_id: str):
+        self.session_id = session_id
+        self.context: Optional[List[int]] = None  # токены диалога, возвращенные Ollama
+        self.seen_chunk_ids: Set[str] = set()
+        self.turns = 0
+        self.last_used = time.monotonic()
+
+    def update(self, context: Optional[List[int]], chunk_ids: List[str]) -> None:
+        self.turns += 1
+        self.last_used = time.monotonic()
+        if not context or len(context) > config.SESSION_MAX_CONTEXT_TOKENS:
+            # Диалог не помещается в окно модели: следующий ход начнется с полного промпта
+            self.reset()
+            return
+        self.context = context
+        self.seen_chunk_ids.update(chunk_ids)
+
+    def reset(self) -> None:
+        self.context = None
+        self.seen_chunk_ids = set()
+
+class SessionStore:
+    """LRU-хранилище сессий: не больше SESSION_MAX_COUNT, неактивные дольше SESSION_TTL_S удаляются"""
+
+    def __init__(self, max_sessions: int = None, ttl: float = None):
+        self.max_sessions = max_sessions or config.SESSION_MAX_COUNT
+        self.ttl = ttl or config.SESSION_TTL_S
+        self.sessions: "OrderedDict[str, ChatSession]" = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, session_id: str) -> ChatSession:
+        with self.lock:
+            now = time.monotonic()
+            for stale_id in [sid for sid, s in self.sessions.items() if now - s.last_used > self.ttl]:
+                del self.sessions[stale_id]
+
+            session = self.sessions.get(session_id)
+            if session is None:
+                session = self.sessions[session_id] = ChatSession(session_id)
+                while len(self.sessions) > self.max_sessions:
+                    self.sessions.popitem(last=False)
+            self.sessions.move_to_end(session_id)
+            return session
+
+    def drop(self, session_id: str) -> None:
+        with self.lock:
+            self.sessions.pop(session_id, None)
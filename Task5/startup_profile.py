@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+"""
+Ленивые импорты тяжелых зависимостей и профиль времени запуска (--startup-profile)
+"""
+
+import importlib
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import List, Tuple
+
+class StartupProfile:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started = time.perf_counter()
+        self.stages: List[Tuple[str, str, float]] = []
+
+    @contextmanager
+    def measure(self, kind: str, name: str):
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.stages.append((kind, name, time.perf_counter() - start_time))
+
+    def report(self) -> None:
+        print("\n" + "=" * 60)
+        print("⏱️ ПРОФИЛЬ ЗАПУСКА")
+        print("=" * 60)
+        for kind in ("import", "init"):
+            stages = [(name, seconds) for k, name, seconds in self.stages if k == kind]
+            if not stages:
+                continue
+            title = "Импорт модулей" if kind == "import" else "Инициализация"
+            print(f"{title}: {sum(s for _, s in stages):.3f} сек")
+            for name, seconds in stages:
+                print(f"   {seconds:8.3f} сек  {name}")
+        print(f"Всего с момента запуска: {time.perf_counter() - self.started:.3f} сек")
+        print("=" * 60)
+
+# Общий профиль процесса
+startup = StartupProfile()
+
+def lazy_import(module_name: str):
+    """importlib.import_module с замером времени первого импорта"""
+    if module_name in sys.modules:
+        return sys.modules[module_name]
+    with startup.measure("import", module_name):
+        return importlib.import_module(module_name)
@@ -6,22 +6,22 @@
 import os
 import time
 import json
-from sentence_transformers import SentenceTransformer
-import chromadb
+
+from profiler import add_profile_argument, profiling
+from startup_profile import lazy_import, startup
 
 def load_embedding_model(model_path=None, model_name=None):
     """Загрузка модели для тестирования"""
+    get_embedding_model = lazy_import("embedding_service").get_embedding_model
     try:
         if model_path and os.path.exists(model_path):
-            model = SentenceTransformer(model_path)
+            model = get_embedding_model(model_path)
             model._model_name = os.path.basename(model_path)
             return model
         elif model_name:
-            model = SentenceTransformer(model_name)
-            model._model_name = model_name
-            return model
+            return get_embedding_model(model_name)
         else:
-            model = SentenceTransformer("sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2")
+            model = get_embedding_model("sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2")
             model._model_name = "paraphrase-multilingual-MiniLM-L12-v2"
             return model
     except Exception as e:
@@ -88,8 +88,10 @@ def run_comprehensive_test():
         return
 
     try:
-        client = chromadb.PersistentClient(path="vector_index")
-        collection = client.get_collection("knowledge_base")
+        chromadb = lazy_import("chromadb")
+        with startup.measure("init", "векторная БД"):
+            client = chromadb.PersistentClient(path="vector_index")
+            collection = client.get_collection("knowledge_base")
 
         print(f"✅ Индекс загружен. Чанков: {collection.count()}")
 
@@ -213,6 +215,7 @@ def quick_test():
         return
 
     try:
+        chromadb = lazy_import("chromadb")
         client = chromadb.PersistentClient(path="vector_index")
         collection = client.get_collection("knowledge_base")
 
@@ -242,10 +245,17 @@ if __name__ == "__main__":
     parser.add_argument("--quick", action="store_true", help="Быстрое тестирование")
     parser.add_argument("--model-path", help="Путь к локальной модели")
     parser.add_argument("--model-name", help="Название онлайн модели")
+    parser.add_argument("--startup-profile", action="store_true", help="Показать время импорта и инициализации")
+    add_profile_argument(parser)
 
     args = parser.parse_args()
 
-    if args.quick:
-        quick_test()
-    else:
-        run_comprehensive_test()
\ No newline at end of file
+    try:
+        with profiling(args.profile, "test_index"):
+            if args.quick:
+                quick_test()
+            else:
+                run_comprehensive_test()
+    finally:
+        if args.startup_profile:
+            startup.report()
\ No newline at end of file
@@ -5,12 +5,13 @@
 
 import os
 import time
-from sentence_transformers import SentenceTransformer
-import chromadb
+
+from startup_profile import lazy_import
 
 def load_embedding_model():
+    get_embedding_model = lazy_import("embedding_service").get_embedding_model
     try:
-        model = SentenceTransformer("sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2")
+        model = get_embedding_model("sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2")
         print("✅ Модель эмбеддингов загружена")
         return model
     except Exception as e:
@@ -18,6 +19,7 @@ def load_embedding_model():
         return None
 
 def connect_vector_db():
+    chromadb = lazy_import("chromadb")
     try:
         client = chromadb.PersistentClient(path="vector_index")
         collection = client.get_collection("knowledge_base")
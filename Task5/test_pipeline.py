@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+"""
+Сквозной тест RAGPipeline и HTTP API (server.py + rag_client.py) без GPU
+и скачивания моделей: хэш-эмбеддинги (EMBEDDING_BACKEND=fake), временная
+коллекция Chroma и заглушка Ollama
+
+    python test_pipeline.py
+    python -m pytest test_pipeline.py
+"""
+
+import http.client
+import json
+import shutil
+import tempfile
+import threading
+import urllib.error
+from contextlib import contextmanager
+
+from config import config
+from fake_embeddings import HashEmbeddingModel
+from fake_ollama import FakeProfile, start_fake_ollama
+from injection_scanner import get_scanner
+from rag_client import RAGServerClient
+from server import create_server
+from startup_profile import lazy_import
+
+DOCUMENTS = {
+    "ignis.txt": "Дракон Игнис охраняет северную башню Серого замка и ненавидит зиму.",
+    "mira.txt": "Волшебница Мира варит зелья в долине Туманов и учит детей грамоте.",
+    "port.txt": "Торговый порт Альба открыт для кораблей с весны до поздней осени."
+}
+
+def build_collection(path: str) -> None:
+    """Коллекция в формате build_index.py: по одному чанку на документ"""
+    chromadb = lazy_import("chromadb")
+    client = chromadb.PersistentClient(path=path)
+    collection = client.create_collection(
+        name=config.COLLECTION_NAME,
+        metadata={"hnsw:space": "cosine", "injection_patterns": get_scanner().signature}
+    )
+    names = sorted(DOCUMENTS)
+    texts = [f"Документ: {name[:-4]}\nТема: {name[:-4]}\n\n{DOCUMENTS[name]}" for name in names]
+    collection.add(
+        ids=[f"chunk_{i}" for i in range(len(names))],
+        embeddings=HashEmbeddingModel().encode(texts).tolist(),
+        documents=texts,
+        metadatas=[{"source": name, "title": name[:-4], "chunk_id": 0, "flagged": False} for name in names]
+    )
+
+@contextmanager
+def fake_environment(profile: FakeProfile = None):
+    """Настройки config на время теста: хэш-эмбеддинги, временный индекс, заглушка Ollama"""
+    index_path = tempfile.mkdtemp(prefix="rag_test_index_")
+    server = start_fake_ollama(profile=profile)
+    overrides = {
+        "EMBEDDING_BACKEND": "fake",
+        "VECTOR_DB_PATH": index_path,
+        "LLM_API_URL": f"http://127.0.0.1:{server.server_address[1]}/api/generate",
+        "SUMMARIES_ENABLED": False,
+        "TRACE_PATH": "",
+        "QUERY_DEADLINE_S": 10
+    }
+    saved = {name: getattr(config, name) for name in overrides}
+    for name, value in overrides.items():
+        setattr(config, name, value)
+    try:
+        build_collection(index_path)
+        yield
+    finally:
+        for name, value in saved.items():
+            setattr(config, name, value)
+        server.shutdown()
+        server.server_close()
+        shutil.rmtree(index_path, ignore_errors=True)
+
+@contextmanager
+def rag_server():
+    """HTTP API над RAGPipeline на свободном порту; внутри fake_environment()"""
+    from rag_pipeline import RAGPipeline
+    server = create_server(RAGPipeline(), "127.0.0.1", 0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        yield server
+    finally:
+        server.shutdown()
+        server.server_close()
+
+def post(server, path: str, body: bytes) -> http.client.HTTPResponse:
+    connection = http.client.HTTPConnection(*server.server_address[:2], timeout=30)
+    connection.request("POST", path, body=body, headers={"Content-Type": "application/json"})
+    return connection.getresponse()
+
+def test_answer_query():
+    """Вопрос проходит поиск, фильтрацию и генерацию; ответ приходит от заглушки"""
+    with fake_environment():
+        from rag_pipeline import RAGPipeline
+        rag = RAGPipeline()
+        record = rag.answer_query("Какую башню охраняет дракон Игнис?")
+
+    assert record["chunk_ids"][0] == "chunk_0", record["chunk_ids"]
+    assert record["degraded"] is None
+    assert record["answer"].startswith("Тестовый ответ"), record["answer"]
+    assert {"vector_query", "llm_generate"} <= set(record["timings"]), record["timings"]
+
+def test_stream_query():
+    """Потоковый ответ по частям совпадает с ответом заглушки"""
+    with fake_environment():
+        from rag_pipeline import RAGPipeline
+        rag = RAGPipeline()
+        parts = list(rag.stream_query("Где варит зелья волшебница Мира?"))
+
+    assert len(parts) > 1
+    assert "".join(parts).strip().startswith("Тестовый ответ")
+
+def test_llm_failure_degrades():
+    """Каждый запрос к Ollama - ошибка 500 или обрыв: ответ деградирует, а не падает"""
+    with fake_environment(FakeProfile(failure_rate=1.0)):
+        from rag_pipeline import RAGPipeline
+        rag = RAGPipeline()
+        record = rag.answer_query("Когда открыт торговый порт Альба?", deadline=3)
+
+    assert record["degraded"] is not None
+    assert record["answer"]
+
+def test_server_health():
+    """GET /health: число чанков в коллекции"""
+    with fake_environment(), rag_server() as server:
+        client = RAGServerClient("http://%s:%d" % server.server_address[:2])
+        health = client.health()
+
+    assert health["status"] == "ok"
+    assert health["chunks"] == len(DOCUMENTS)
+
+def test_server_query():
+    """POST /query через RAGServerClient: та же запись, что у answer_query"""
+    with fake_environment(), rag_server() as server:
+        client = RAGServerClient("http://%s:%d" % server.server_address[:2])
+        record = client.answer_query("Какую башню охраняет дракон Игнис?")
+
+    assert record["chunk_ids"][0] == "chunk_0", record["chunk_ids"]
+    assert record["degraded"] is None
+    assert record["answer"].startswith("Тестовый ответ"), record["answer"]
+
+def test_server_stream():
+    """POST /query/stream: chunked NDJSON с финальным done и разбор в RAGServerClient.stream_query"""
+    with fake_environment(), rag_server() as server:
+        response = post(server, "/query/stream", json.dumps({"query": "Где варит зелья волшебница Мира?"}).encode())
+        assert response.status == 200
+        assert response.getheader("Transfer-Encoding") == "chunked"
+        messages = [json.loads(line) for line in response.read().decode("utf-8").splitlines()]
+
+        client = RAGServerClient("http://%s:%d" % server.server_address[:2])
+        parts = list(client.stream_query("Где варит зелья волшебница Мира?"))
+
+    assert messages[-1] == {"response": "", "done": True}
+    assert all(not message["done"] for message in messages[:-1])
+    assert len(parts) > 1
+    assert "".join(parts) == "".join(message["response"] for message in messages)
+    assert "".join(parts).strip().startswith("Тестовый ответ")
+
+def test_server_bad_request():
+    """Тело без вопроса: 400 на /query и /query/stream, в том числе через клиент"""
+    with fake_environment(), rag_server() as server:
+        statuses = [post(server, path, body).status
+                    for path in ("/query", "/query/stream")
+                    for body in (b"{}", b'{"query": "  "}', b"not json")]
+
+        client = RAGServerClient("http://%s:%d" % server.server_address[:2])
+        try:
+            client.answer_query("")
+            error = None
+        except urllib.error.HTTPError as e:
+            error = e.code
+
+    assert statuses == [400] * 6, statuses
+    assert error == 400
+
+if __name__ == "__main__":
+    for test in (test_answer_query, test_stream_query, test_llm_failure_degrades,
+                 test_server_health, test_server_query, test_server_stream, test_server_bad_request):
+        test()
+        print(f"✅ {test.__name__}")
+    print("✅ Все тесты пройдены")
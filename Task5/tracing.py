@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+Трассировка пути запроса: этапы (embed, vector_query, filter, prompt_build,
+llm_ttft, ...) с атрибутами, запись трасс в JSONL и гистограммы этапов в metrics
+"""
+
+import json
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional
+
+from config import config
+from metrics import metrics
+from profiler import stage as profile_stage
+
+STAGE_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+_local = threading.local()
+_write_lock = threading.Lock()
+
+class Trace:
+    def __init__(self, name: str, **attributes):
+        self.trace_id = uuid.uuid4().hex[:16]
+        self.name = name
+        self.attributes = dict(attributes)
+        self.started = time.perf_counter()
+        self.timestamp = time.time()
+        self.spans: List[Dict] = []
+        self.open_spans: List[Dict] = []
+
+    def record(self, name: str, seconds: float, **attributes) -> Dict:
+        """Этап, длительность которого уже измерена"""
+        span = {
+            "name": name,
+            "start_ms": round((time.perf_counter() - self.started - seconds) * 1000, 2),
+            "duration_ms": round(seconds * 1000, 2),
+            **attributes
+        }
+        self.spans.append(span)
+        return span
+
+    def timings(self) -> Dict[str, float]:
+        """Суммарное время этапов, сек (повторяющиеся этапы складываются)"""
+        totals: Dict[str, float] = {}
+        for span in self.spans:
+            totals[span["name"]] = round(totals.get(span["name"], 0) + span["duration_ms"] / 1000, 4)
+        return totals
+
+    def to_dict(self) -> Dict:
+        return {
+            "trace_id": self.trace_id,
+            "name": self.name,
+            "timestamp": round(self.timestamp, 3),
+            "duration_ms": round((time.perf_counter() - self.started) * 1000, 2),
+            "attributes": self.attributes,
+            "spans": self.spans
+        }
+
+    def summary(self) -> str:
+        return " | ".join(f"{span['name']} {span['duration_ms']:.1f} мс" for span in self.spans)
+
+def current_trace() -> Optional[Trace]:
+    return getattr(_local, "trace", None)
+
+def write_trace(record: Dict) -> None:
+    if not config.TRACE_PATH:
+        return
+    line = json.dumps(record, ensure_ascii=False) + "\n"
+    with _write_lock:
+        with open(config.TRACE_PATH, 'a', encoding='utf-8') as f:
+            f.write(line)
+
+@contextmanager
+def trace(name: str, **attributes) -> Iterator[Trace]:
+    """
+    Трасса запроса в текущем потоке. Вложенный вызов (process_query ->
+    answer_query) продолжает уже открытую трассу. Трасса собирается всегда
+    (из нее берутся timings ответа), в файл пишется, если задан TRACE_PATH.
+    """
+    active = current_trace()
+    if active is not None:
+        active.attributes.update(attributes)
+        yield active
+        return
+
+    _local.trace = current = Trace(name, **attributes)
+    try:
+        yield current
+    finally:
+        _local.trace = None
+        total = time.perf_counter() - current.started
+        current.record("total", total)
+        metrics.observe('stage_seconds{stage="total"}', total, STAGE_BUCKETS)
+        write_trace(current.to_dict())
+
+@contextmanager
+def span(name: str, **attributes) -> Iterator[Dict]:
+    """
+    Этап запроса: длительность попадает в гистограмму stage_seconds{stage=...}
+    и, если открыта трасса, в ее список этапов. Атрибуты можно дополнять в теле блока.
+    При --profile mem этап также попадает в профиль памяти.
+    """
+    attributes = dict(attributes)
+    active = current_trace()
+    if active is not None:
+        active.open_spans.append(attributes)
+    started = time.perf_counter()
+    try:
+        with profile_stage(name):
+            yield attributes
+    finally:
+        record_span(name, time.perf_counter() - started, **attributes)
+        if active is not None and active.open_spans and active.open_spans[-1] is attributes:
+            active.open_spans.pop()
+
+def record_span(name: str, seconds: float, **attributes) -> None:
+    """Этап с уже измеренной длительностью (например, время до первого токена)"""
+    metrics.observe(f'stage_seconds{{stage="{name}"}}', seconds, STAGE_BUCKETS)
+    active = current_trace()
+    if active is not None:
+        active.record(name, seconds, **attributes)
+
+def annotate(**attributes) -> None:
+    """Атрибуты текущего этапа (или трассы, если этап не открыт): попадания в кэш и т.п."""
+    active = current_trace()
+    if active is None:
+        return
+    target = active.open_spans[-1] if active.open_spans else active.attributes
+    target.update(attributes)